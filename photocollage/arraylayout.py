@@ -0,0 +1,201 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Array-backed version of the layout maths of collage.Page.
+
+This module requires NumPy, which is an optional dependency.
+
+The columns and cells of a page are flattened into arrays:
+
+col_w      width of each column
+cell_h     height of each cell (cell extents are not cells)
+cell_col   index of the first column of each cell
+cell_span  number of columns taken by each cell (1 or 2)
+
+Each column is a sequence of "slots", stored column after column (the slots
+of column i are slot_cell[col_start[i]:col_start[i + 1]]):
+
+slot_cell  index of the cell in each slot (the origin for cell extents)
+slot_ext   whether the slot is a cell extent
+
+Scaling and height adjustment are then array operations. Since the y of a
+cell extent is the y of its origin, which lies in the previous column,
+columns are still processed one after the other, but each column is handled
+at once.
+
+The page structure (which cell is in which column) is not modified here:
+photos are placed and holes are removed with collage.Page, then the arrays
+are built, transformed, and written back with update_page().
+
+"""
+
+import numpy as np
+
+
+class ArrayLayout:
+    def __init__(self, page):
+        self.page = page
+        self.target_ratio = page.target_ratio
+
+        self.cells = []
+        index = {}
+        slot_cell = []
+        slot_ext = []
+        col_start = [0]
+        cell_col = []
+        cell_span = []
+        for i, col in enumerate(page.cols):
+            for c in col.cells:
+                if c.is_extension():
+                    slot_cell.append(index[c.origin])
+                    slot_ext.append(True)
+                else:
+                    index[c] = len(self.cells)
+                    self.cells.append(c)
+                    cell_col.append(i)
+                    cell_span.append(len(c.parents))
+                    slot_cell.append(index[c])
+                    slot_ext.append(False)
+            col_start.append(len(slot_cell))
+
+        self.col_w = np.array([col.w for col in page.cols], dtype=float)
+        self.cell_h = np.array([c.h for c in self.cells], dtype=float)
+        self.cell_col = np.array(cell_col, dtype=np.intp)
+        self.cell_span = np.array(cell_span, dtype=np.intp)
+        self.slot_cell = np.array(slot_cell, dtype=np.intp)
+        self.slot_ext = np.array(slot_ext, dtype=bool)
+        self.col_start = np.array(col_start, dtype=np.intp)
+
+        self.cell_y = None
+
+    @property
+    def no_cols(self):
+        return len(self.col_w)
+
+    @property
+    def col_x(self):
+        x = np.zeros(self.no_cols)
+        np.cumsum(self.col_w[:-1], out=x[1:])
+        return x
+
+    @property
+    def w(self):
+        return np.cumsum(self.col_w)[-1]
+
+    @property
+    def h(self):
+        self.update_cells_y()
+        ends = self.col_start[1:] - 1
+        bottom = self.slot_cell[ends]
+        return np.max(self.cell_y[bottom] + self.cell_h[bottom])
+
+    @property
+    def ratio(self):
+        return self.h / self.w
+
+    @property
+    def cell_x(self):
+        return self.col_x[self.cell_col]
+
+    @property
+    def cell_w(self):
+        w = self.col_w[self.cell_col]
+        extended = self.cell_span > 1
+        w[extended] += self.col_w[self.cell_col[extended] + 1]
+        return w
+
+    def col_slots(self, i):
+        s, e = self.col_start[i], self.col_start[i + 1]
+        return self.slot_cell[s:e], self.slot_ext[s:e]
+
+    def compute_col_y(self, i, cell_y):
+        """Set the y of the cells in column i
+
+        A cell is below the previous slot, except for cell extents that take
+        the y of their origin (already computed in column i - 1).
+
+        """
+        cells, ext = self.col_slots(i)
+        h = self.cell_h[cells]
+        above = np.zeros(len(h))
+        np.cumsum(h[:-1], out=above[1:])
+        starts = np.where(ext, np.arange(len(h)), 0)
+        np.maximum.accumulate(starts, out=starts)
+        base = np.where(ext, cell_y[cells], 0.0)
+        y = base[starts] + above - above[starts]
+        cell_y[cells[~ext]] = y[~ext]
+
+    def update_cells_y(self):
+        if self.cell_y is None:
+            cell_y = np.zeros(len(self.cells))
+            for i in range(self.no_cols):
+                self.compute_col_y(i, cell_y)
+            self.cell_y = cell_y
+
+    def coords(self):
+        """Returns the x, y, w, h arrays of all cells"""
+        self.update_cells_y()
+        return self.cell_x, self.cell_y, self.cell_w, self.cell_h
+
+    def scale(self, alpha):
+        self.col_w *= alpha
+        self.cell_h *= alpha
+        self.cell_y = None
+
+    def scale_to_fit(self, max_w, max_h=None):
+        if max_h is None or self.w * max_h > self.h * max_w:
+            self.scale(max_w / self.w)
+        else:
+            self.scale(max_h / self.h)
+
+    def adjust_col_height(self, i, target_h, cell_y):
+        """Same as collage.Column.adjust_height(), for column i
+
+        Cells between two cell extents form a group, which is resized to
+        fill the space between these extents.
+
+        """
+        cells, ext = self.col_slots(i)
+        group = np.cumsum(ext)[~ext]
+        movable = cells[~ext]
+        ext_cells = cells[ext]
+        ext_y = cell_y[ext_cells]
+        tops = np.concatenate(([0.0], ext_y + self.cell_h[ext_cells]))
+        bottoms = np.concatenate((ext_y, [target_h]))
+        total = np.bincount(group, weights=self.cell_h[movable],
+                            minlength=len(tops))
+        alpha = np.ones(len(tops))
+        nonzero = total != 0
+        alpha[nonzero] = (bottoms - tops)[nonzero] / total[nonzero]
+        self.cell_h[movable] *= alpha[group]
+
+    def adjust_cols_heights(self):
+        target_h = self.w * self.target_ratio
+        cell_y = np.zeros(len(self.cells))
+        for i in range(self.no_cols):
+            self.adjust_col_height(i, target_h, cell_y)
+            self.compute_col_y(i, cell_y)
+        self.cell_y = cell_y
+
+    def update_page(self):
+        """Write widths and heights back to the collage.Page objects"""
+        for col, w in zip(self.page.cols, self.col_w.tolist()):
+            col.w = w
+        for c, h in zip(self.cells, self.cell_h.tolist()):
+            c.h = h
+        self.page.target_ratio = self.target_ratio
+        self.page.invalidate_cache()
@@ -15,6 +15,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import base64
+import functools
 from io import BytesIO
 
 import cairo
@@ -94,6 +95,9 @@ ICON_DRAG_AND_DROP = (
     "U4Z3kUZTSagAAAAASUVORK5CYII=")
 
 
+# Decoded images are cached: they are painted on every redraw, and must not
+# be modified by callers.
+@functools.lru_cache(maxsize=None)
 def load_pixbuf(encoded):
     loader = GdkPixbuf.PixbufLoader.new_with_type("png")
     loader.write(base64.b64decode(encoded))
@@ -101,6 +105,7 @@ def load_pixbuf(encoded):
     return loader.get_pixbuf()
 
 
+@functools.lru_cache(maxsize=None)
 def load_cairo_surface(encoded):
     buf = BytesIO()
     buf.write(base64.b64decode(encoded))
@@ -14,7 +14,11 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import bisect
+import heapq
+import math
 import random
+import time
 
 """
 Summary of collage objects:
@@ -77,6 +81,8 @@ Phase C: Adapt columns' width.
 
 
 class Photo:
+    __slots__ = ("filename", "w", "h", "orientation", "offset_w", "offset_h")
+
     def __init__(self, filename, w, h, orientation=0):
         self.filename = filename
         self.w = w
@@ -85,6 +91,14 @@ class Photo:
         self.offset_w = 0.5
         self.offset_h = 0.5
 
+    def __getstate__(self):
+        return (self.filename, self.w, self.h, self.orientation,
+                self.offset_w, self.offset_h)
+
+    def __setstate__(self, state):
+        (self.filename, self.w, self.h, self.orientation,
+         self.offset_w, self.offset_h) = state
+
     @property
     def ratio(self):
         return float(self.h) / float(self.w)
@@ -117,12 +131,20 @@ class Cell:
     ---------------------- v
 
     """
+    __slots__ = ("parents", "photo", "extent", "h")
+
     def __init__(self, parents, photo):
         self.parents = parents
         self.photo = photo
         self.extent = None
         self.h = self.w * self.wanted_ratio
 
+    def __getstate__(self):
+        return (self.parents, self.photo, self.extent, self.h)
+
+    def __setstate__(self, state):
+        self.parents, self.photo, self.extent, self.h = state
+
     def __repr__(self):
         """Representation of the cell in ASCII art"""
         end = "]"
@@ -139,16 +161,10 @@ class Cell:
         """Returns the cell's y coordinate
 
         It assumes that the cell is in a single column, so it is the previous
-        cell's y + h.
+        cell's y + h. The value is cached by the page.
 
         """
-        prev = None
-        for c in self.parents[0].cells:
-            if self is c:
-                if prev:
-                    return prev.y + prev.h
-                return 0
-            prev = c
+        return self.parents[0].parent.get_cell_y(self)
 
     @property
     def w(self):
@@ -166,7 +182,7 @@ class Cell:
         self.h *= alpha
 
     def is_extended(self):
-        return hasattr(self, 'extent') and self.extent is not None
+        return self.extent is not None
 
     def is_extension(self):
         return isinstance(self, CellExtent)
@@ -216,6 +232,8 @@ class Cell:
 
 
 class CellExtent(Cell):
+    __slots__ = ("origin",)
+
     def __init__(self, cell):
         self.origin = cell
         self.origin.extent = self
@@ -224,6 +242,12 @@ class CellExtent(Cell):
         """Representation of the cell in ASCII art"""
         return "------]"
 
+    def __getstate__(self):
+        return (self.origin,)
+
+    def __setstate__(self, state):
+        self.origin, = state
+
     @property
     def parents(self):
         return (self.origin.parents[1],)
@@ -240,6 +264,9 @@ class CellExtent(Cell):
     def h(self):
         return self.origin.h
 
+    def is_extended(self):
+        return False
+
     def scale(self, alpha):
         pass
 
@@ -259,11 +286,20 @@ class Column:
            --------
 
     """
+    __slots__ = ("parent", "cells", "w")
+
     def __init__(self, parent, w):
         self.parent = parent
         self.cells = []
         self.w = w
 
+    def __getstate__(self):
+        # Cells are saved by the page, see Page.__getstate__()
+        return (self.parent, self.w)
+
+    def __setstate__(self, state):
+        self.parent, self.w = state
+
     def __repr__(self):
         """Representation of the column in ASCII art"""
         return "\n".join(c.__repr__() for c in self.cells)
@@ -282,33 +318,29 @@ class Column:
 
     @property
     def x(self):
-        x = 0
-        for c in self.parent.cols:
-            if self is c:
-                break
-            x += c.w
-        return x
+        return self.parent.get_col_x(self)
+
+    def append(self, cell):
+        self.cells.append(cell)
+        self.parent.cell_appended(self, cell)
 
     def scale(self, alpha):
         self.w *= alpha
         for c in self.cells:
             c.scale(alpha)
+        self.parent.invalidate_cache()
 
     def left_neighbor(self):
         """Returns the column on the left of this one"""
-        prev = None
-        for c in self.parent.cols:
-            if self is c:
-                return prev
-            prev = c
+        i = self.parent.get_col_index(self)
+        if i > 0:
+            return self.parent.cols[i - 1]
 
     def right_neighbor(self):
         """Returns the column on the right of this one"""
-        prev = None
-        for c in reversed(self.parent.cols):
-            if self is c:
-                return prev
-            prev = c
+        i = self.parent.get_col_index(self)
+        if i < len(self.parent.cols) - 1:
+            return self.parent.cols[i + 1]
 
     def adjust_height(self, target_h):
         """Set the column's height to a given value by resizing cells"""
@@ -337,10 +369,15 @@ class Column:
         for group in groups:
             if not group.cells:
                 continue
-            alpha = group.h / sum(c.h for c in group.cells)
+            total = sum(c.h for c in group.cells)
+            if total == 0:
+                continue
+            alpha = group.h / total
             for c in group.cells:
                 c.h = c.h * alpha
 
+        self.parent.invalidate_cache(self)
+
 
 class Page:
     """Represents a whole page
@@ -362,6 +399,48 @@ class Page:
         self.cols = []
         for i in range(no_cols):
             self.cols.append(Column(self, col_w))
+        self.invalidate_cache()
+
+    def __getstate__(self):
+        # Columns are saved before their cells. Otherwise, since cells refer
+        # to their parent columns, copying or pickling would recurse from one
+        # column to the next one and hit the recursion limit on large pages.
+        # Cached coordinates are not saved, they are cheap to recompute.
+        return (self.target_ratio, self.cols, [c.cells for c in self.cols])
+
+    def __setstate__(self, state):
+        self.target_ratio, self.cols, cells = state
+        for col, col_cells in zip(self.cols, cells):
+            col.cells = col_cells
+        self.invalidate_cache()
+
+    def copy(self):
+        """Returns a copy of the page, sharing the same photos
+
+        This is much faster than copy.deepcopy() since columns and cells are
+        created directly, and photos are not copied. Photos must then not be
+        modified in place by users of one of the pages.
+
+        """
+        page = Page.__new__(Page)
+        page.target_ratio = self.target_ratio
+        page.cols = [Column(page, col.w) for col in self.cols]
+        copies = {}
+        for i, col in enumerate(self.cols):
+            new_col = page.cols[i]
+            for c in col.cells:
+                if c.is_extension():
+                    new_col.cells.append(CellExtent(copies[c.origin]))
+                else:
+                    cell = Cell.__new__(Cell)
+                    cell.parents = tuple(page.cols[i:i + len(c.parents)])
+                    cell.photo = c.photo
+                    cell.extent = None
+                    cell.h = c.h
+                    copies[c] = cell
+                    new_col.cells.append(cell)
+        page.invalidate_cache()
+        return page
 
     def __repr__(self):
         """Representation of the page in ASCII art
@@ -376,24 +455,17 @@ class Page:
         [125 91--             [125 89--  [62 64]
                                  ------]
         """
+        # Each column's representation is computed once, then lines are
+        # assembled side by side
+        cols = [col.__repr__().split("\n") for col in self.cols]
+        widths = [max(len(cell) for cell in cells) + 1 for cells in cols]
+        if widths:
+            widths[-1] -= 1
         lines = []
-        n = 0
-        end = False
-        while not end:
-            lines.append("")
-            end = True
-            for col in self.cols:
-                cells = col.__repr__().split("\n")
-                w = max(len(cell) for cell in cells)
-                if col != self.cols[-1]:
-                    w += 1
-                cell = w * " "
-                if n < len(cells):
-                    cell = cells[n] + (w - len(cells[n])) * " "
-                    if n < len(cells) - 1:
-                        end = False
-                lines[-1] += cell
-            n += 1
+        for n in range(max((len(cells) for cells in cols), default=1)):
+            lines.append("".join(
+                (cells[n] if n < len(cells) else "").ljust(w)
+                for cells, w in zip(cols, widths)))
         return "\n".join(lines)
 
     @property
@@ -402,7 +474,9 @@ class Page:
 
     @property
     def w(self):
-        return sum(c.w for c in self.cols)
+        if self._cols_x is None:
+            self.update_cols_cache()
+        return self._w
 
     @property
     def h(self):
@@ -412,6 +486,84 @@ class Page:
     def ratio(self):
         return self.h / self.w
 
+    def invalidate_cache(self, col=None):
+        """Forget cached coordinates of columns and cells
+
+        It must be called each time columns or cells are moved, removed or
+        resized. Since a cell's y only depends on the cells above it and on
+        the columns on its left (through cell extents), passing the modified
+        column only forgets the coordinates of this column and the following
+        ones.
+
+        """
+        if col is None:
+            self._cols_x = None
+            self._cells_y = {}
+            self._valid_cols = 0
+        else:
+            self._valid_cols = min(self._valid_cols, self.get_col_index(col))
+        self._cols_heap = None
+        self._cells_index = {}
+
+    def update_cols_cache(self):
+        self._cols_index = {}
+        self._cols_x = {}
+        self._cols_starts = []
+        x = 0
+        for i, c in enumerate(self.cols):
+            self._cols_index[c] = i
+            self._cols_x[c] = x
+            self._cols_starts.append(x)
+            x += c.w
+        self._w = x
+
+    def get_col_index(self, col):
+        if self._cols_x is None:
+            self.update_cols_cache()
+        return self._cols_index[col]
+
+    def get_col_x(self, col):
+        if self._cols_x is None:
+            self.update_cols_cache()
+        return self._cols_x[col]
+
+    def get_cell_y(self, cell):
+        """Returns the cell's y coordinate, computing it if needed
+
+        Coordinates are computed column by column, from left to right, so that
+        the origin of a cell extent always comes before the extent itself.
+
+        """
+        i = self.get_col_index(cell.parents[0])
+        while self._valid_cols <= i:
+            y = 0
+            for c in self.cols[self._valid_cols].cells:
+                if c.is_extension():
+                    y = self._cells_y[c.origin]
+                self._cells_y[c] = y
+                y += c.h
+            self._valid_cols += 1
+        return self._cells_y[cell]
+
+    def cell_appended(self, col, cell):
+        """Update cached coordinates after a cell was put at a column bottom
+
+        Cells above are not moved, so there is no need to recompute
+        everything.
+
+        """
+        if self.get_col_index(col) < self._valid_cols:
+            if cell.is_extension():
+                self._cells_y[cell] = self.get_cell_y(cell.origin)
+            elif len(col.cells) > 1:
+                prev = col.cells[-2]
+                self._cells_y[cell] = self._cells_y[prev] + prev.h
+            else:
+                self._cells_y[cell] = 0
+        if self._cols_heap is not None:
+            self.update_cols_heap(col)
+        self._cells_index.pop(col, None)
+
     def scale(self, alpha):
         for c in self.cols:
             c.scale(alpha)
@@ -422,23 +574,58 @@ class Page:
         else:
             self.scale(max_h / self.h)
 
+    def update_cols_heap(self, col=None):
+        """Keep columns sorted by height in a heap
+
+        Heap entries are [h, index, count, col] lists. When a column grows,
+        its previous entry is marked as removed (col set to None) and a new
+        one is pushed. The heap is rebuilt from scratch if no column is given
+        or if it was dropped by invalidate_cache().
+
+        """
+        if col is None or self._cols_heap is None:
+            self._cols_heap = []
+            self._cols_heap_entries = {}
+            self._cols_heap_count = 0
+            cols = self.cols
+        else:
+            self._cols_heap_entries.pop(col)[-1] = None
+            cols = (col,)
+        for c in cols:
+            entry = [c.h, self.get_col_index(c), self._cols_heap_count, c]
+            self._cols_heap_count += 1
+            self._cols_heap_entries[c] = entry
+            heapq.heappush(self._cols_heap, entry)
+
     def next_free_col(self):
-        """Returns the column with lowest height"""
-        minimum = min(c.h for c in self.cols)
+        """Returns the column with lowest height
+
+        If several columns have the same height, one of them is randomly
+        chosen.
+
+        """
+        if self._cols_heap is None:
+            self.update_cols_heap()
         candidates = []
-        for c in self.cols:
-            if c.h == minimum:
-                candidates.append(c)
-        return random.choice(candidates)
+        while self._cols_heap:
+            entry = self._cols_heap[0]
+            if entry[-1] is not None:
+                if candidates and entry[0] != candidates[0][0]:
+                    break
+                candidates.append(entry)
+            heapq.heappop(self._cols_heap)
+        for entry in candidates:
+            heapq.heappush(self._cols_heap, entry)
+        return random.choice([entry[-1] for entry in candidates])
 
     def add_cell_single_col(self, col, photo):
-        col.cells.append(Cell((col,), photo))
+        col.append(Cell((col,), photo))
 
     def add_cell_multi_col(self, col1, col2, photo):
         cell = Cell((col1, col2), photo)
         extent = CellExtent(cell)
-        col1.cells.append(cell)
-        col2.cells.append(extent)
+        col1.append(cell)
+        col2.append(extent)
 
     def add_cell(self, photo):
         """Add a new cell in the best computed place
@@ -462,12 +649,16 @@ class Page:
         while i < len(self.cols):
             if len(self.cols[i].cells) == 0:
                 self.cols.pop(i)
+                self.invalidate_cache()
             else:
                 i += 1
 
-    def remove_bottom_holes(self):
+    def remove_bottom_holes(self, cols=None):
         """Remove holes created by extended cells
 
+        If cols is given, only holes at the bottom of these columns are
+        looked for.
+
         Example (case A):
         The bottom-right cell should be extended to fill the hole.
         ----------------------             ----------------------
@@ -489,80 +680,423 @@ class Page:
         ---------------                           ---------------
 
         """
-        for col in self.cols:
-            cell = col.cells[-1]
-            if cell == col.cells[0]:
-                continue
+        if cols is not None:
+            cols = set(cols)
+        moved = True
+        while moved:
+            moved = False
+            for col in self.cols:
+                if cols is not None and col not in cols:
+                    continue
+                cell = col.cells[-1]
+                if cell == col.cells[0]:
+                    continue
+
+                # Case A
+                # If cell is not extended, is below an extended cell and has
+                # no neighbour under the latter, it should be extended.
+                if not cell.is_extended() and not cell.is_extension():
+                    # Case A1
+                    if cell.top_neighbor().is_extended() \
+                            and cell.top_neighbor().extent \
+                            .bottom_neighbor() is None:
+                        # Extend cell to right
+                        extent = CellExtent(cell)
+                        col.right_neighbor().cells.append(extent)
+                        cell.parents = (col, col.right_neighbor())
+                        moved = True
+                    # Case A2
+                    elif cell.top_neighbor().is_extension() \
+                            and cell.top_neighbor().origin \
+                            .bottom_neighbor() is None:
+                        # Extend cell to left
+                        col.cells.remove(cell)
+                        col.left_neighbor().cells.append(cell)
+                        extent = CellExtent(cell)
+                        col.cells.append(extent)
+                        cell.parents = (col.left_neighbor(), col)
+                        moved = True
+                # Case B
+                # If cell is extended and one of the cells above is extended
+                # too, the bottom cell should be placed right below the top
+                # one.
+                elif cell.is_extended() \
+                        and cell.extent.bottom_neighbor() is None:
+                    # Case B1
+                    if cell.extent.top_neighbor() is not None \
+                            and cell.extent.top_neighbor().is_extended() \
+                            and cell.extent.top_neighbor().extent \
+                            .bottom_neighbor() is None:
+                        # Move cell to right
+                        col.cells.remove(cell)
+                        col.right_neighbor().cells.remove(cell.extent)
+                        col.right_neighbor().cells.append(cell)
+                        col.right_neighbor().right_neighbor().cells \
+                            .append(cell.extent)
+                        cell.parents = (col.right_neighbor(),
+                                        col.right_neighbor().right_neighbor())
+                        moved = True
+                    # Case B2
+                    elif cell.top_neighbor().is_extension() \
+                            and cell.top_neighbor().origin \
+                            .bottom_neighbor() is None:
+                        # Move cell to left
+                        col.cells.remove(cell)
+                        col.right_neighbor().cells.remove(cell.extent)
+                        col.left_neighbor().cells.append(cell)
+                        col.cells.append(cell.extent)
+                        cell.parents = (col.left_neighbor(), col)
+                        moved = True
+            # Moving a cell can leave a hole at the bottom of a column that
+            # was already looked at, or that was not given
+            cols = None
+
+        self.invalidate_cache()
+
+    def adjust_cols_heights(self, cols=None):
+        """Set all columns' heights to same value by shrinking them
+
+        If cols is given, only these columns are adjusted, along with the
+        columns on their right that hold extents of resized cells. The
+        adjusted columns are returned.
 
-            # Case A
-            # If cell is not extended, is below an extended cell and has no
-            # neighbour under the latter, it should be extended.
-            if not cell.is_extended() and not cell.is_extension():
-                # Case A1
-                if cell.top_neighbor().is_extended() \
-                        and cell.top_neighbor().extent \
-                        .bottom_neighbor() is None:
-                    # Extend cell to right
-                    extent = CellExtent(cell)
-                    col.right_neighbor().cells.append(extent)
-                    cell.parents = (col, col.right_neighbor())
-                # Case A2
-                elif cell.top_neighbor().is_extension() \
-                        and cell.top_neighbor().origin \
-                        .bottom_neighbor() is None:
-                    # Extend cell to left
-                    col.cells.remove(cell)
-                    col.left_neighbor().cells.append(cell)
-                    extent = CellExtent(cell)
-                    col.cells.append(extent)
-                    cell.parents = (col.left_neighbor(), col)
-            # Case B
-            # If cell is extended and one of the cells above is extended too,
-            # the bottom cell should be placed right below the top one.
-            elif cell.is_extended() and cell.extent.bottom_neighbor() is None:
-                # Case B1
-                if cell.extent.top_neighbor().is_extended() \
-                        and cell.extent.top_neighbor().extent \
-                        .bottom_neighbor() is None:
-                    # Move cell to right
-                    col.cells.remove(cell)
-                    col.right_neighbor().cells.remove(cell.extent)
-                    col.right_neighbor().cells.append(cell)
-                    col.right_neighbor().right_neighbor().cells \
-                        .append(cell.extent)
-                    cell.parents = (col.right_neighbor(),
-                                    col.right_neighbor().right_neighbor())
-                # Case B2
-                elif cell.top_neighbor().is_extension() \
-                        and cell.top_neighbor().origin \
-                        .bottom_neighbor() is None:
-                    # Move cell to left
-                    col.cells.remove(cell)
-                    col.right_neighbor().cells.remove(cell.extent)
-                    col.left_neighbor().cells.append(cell)
-                    col.cells.append(cell.extent)
-                    cell.parents = (col.left_neighbor(), col)
-
-    def adjust_cols_heights(self):
-        """Set all columns' heights to same value by shrinking them"""
+        """
         target_h = self.w * self.target_ratio
+        if cols is None:
+            for c in self.cols:
+                c.adjust_height(target_h)
+            return self.cols
+
+        cols = set(cols)
+        adjusted = []
+        depends = False
         for c in self.cols:
-            c.adjust_height(target_h)
+            if depends or c in cols:
+                c.adjust_height(target_h)
+                adjusted.append(c)
+                depends = any(cell.is_extended() for cell in c.cells)
+            else:
+                depends = False
+        return adjusted
 
     def adjust(self):
         self.remove_empty_cols()
         self.remove_bottom_holes()
         self.adjust_cols_heights()
 
+    def remove_cell(self, cell):
+        """Remove a cell without changing the rest of the layout
+
+        The free space is given to the cells right above and below the
+        removed one, up to the nearest extended cells or cell extents. These
+        are left in place: moving them would move cells of the next columns
+        too. If there is no cell to stretch, removing this one would leave a
+        hole: the page is then left untouched and None is returned.
+        Otherwise, the columns that were changed are returned.
+
+        """
+        if cell.is_extension():
+            cell = cell.origin
+        slots = [(cell.parents[0], cell)]
+        if cell.is_extended():
+            slots.append((cell.parents[1], cell.extent))
+
+        neighbors = []
+        for col, c in slots:
+            i = col.cells.index(c)
+            group = []
+            for cells in (reversed(col.cells[:i]), col.cells[i + 1:]):
+                for n in cells:
+                    if n.is_extension() or n.is_extended():
+                        break
+                    group.append(n)
+            if not group or sum(n.h for n in group) <= 0:
+                return None
+            neighbors.append(group)
+
+        for (col, c), group in zip(slots, neighbors):
+            h = sum(n.h for n in group)
+            alpha = (h + c.h) / h
+            for n in group:
+                n.h *= alpha
+            col.cells.remove(c)
+        self.invalidate_cache(cell.parents[0])
+        return list(cell.parents)
+
+    def add_photos(self, photolist):
+        """Add photos at the bottom of the shortest columns
+
+        Existing cells are not moved, except when fixing holes at the bottom
+        of the columns that received new cells. Only these columns (and the
+        ones depending on them) are adjusted, and they are returned.
+
+        """
+        bottoms = [col.cells[-1] if col.cells else None for col in self.cols]
+        for photo in photolist:
+            self.add_cell(photo)
+        changed = [col for col, bottom in zip(self.cols, bottoms)
+                   if col.cells and col.cells[-1] is not bottom]
+        if not changed:
+            return []
+        self.remove_bottom_holes(changed)
+        changed = [col for col, bottom in zip(self.cols, bottoms)
+                   if col.cells and col.cells[-1] is not bottom]
+        return self.adjust_cols_heights(changed)
+
+    def get_col_cells_index(self, col):
+        """Returns the column's cells and their y coordinates, sorted by y
+
+        The result is cached until the column changes, so that cells can be
+        looked up by bisection.
+
+        """
+        if col not in self._cells_index:
+            cells = sorted(col.cells, key=lambda c: c.y)
+            self._cells_index[col] = ([c.y for c in cells], cells)
+        return self._cells_index[col]
+
     def get_cell_at_position(self, x, y):
+        if self._cols_x is None:
+            self.update_cols_cache()
+        i = bisect.bisect_right(self._cols_starts, x) - 1
+        if i < 0 or x >= self._cols_starts[i] + self.cols[i].w:
+            return None
+        ys, cells = self.get_col_cells_index(self.cols[i])
+        j = bisect.bisect_right(ys, y) - 1
+        if j < 0 or y >= ys[j] + cells[j].h:
+            return None
+        if cells[j].is_extension():
+            return cells[j].origin
+        return cells[j]
+
+    def get_cells_in_rect(self, x, y, w, h):
+        """Returns the cells intersecting a rectangle
+
+        Cells are returned column by column, from top to bottom. Extended
+        cells are returned only once, and cell extents are replaced by their
+        origin.
+
+        """
+        if self._cols_x is None:
+            self.update_cols_cache()
+        found = []
+        seen = set()
+        i0 = max(bisect.bisect_right(self._cols_starts, x) - 1, 0)
+        i1 = bisect.bisect_left(self._cols_starts, x + w)
+        for col in self.cols[i0:i1]:
+            if col.x + col.w <= x:
+                continue
+            ys, cells = self.get_col_cells_index(col)
+            j0 = max(bisect.bisect_right(ys, y) - 1, 0)
+            j1 = bisect.bisect_left(ys, y + h)
+            for cell in cells[j0:j1]:
+                if cell.y + cell.h <= y:
+                    continue
+                if cell.is_extension():
+                    cell = cell.origin
+                if cell not in seen:
+                    seen.add(cell)
+                    found.append(cell)
+        return found
+
+    def crop_loss(self):
+        """Returns the fraction of the photos' area that is cropped out"""
+        lost = total = 0
         for col in self.cols:
-            if x >= col.x and x < col.x + col.w:
-                for cell in col.cells:
-                    if y >= cell.y and y < cell.y + cell.h:
-                        if cell.is_extension():
-                            return cell.origin
-                        return cell
-        return None
+            for c in col.cells:
+                if c.is_extension():
+                    continue
+                x, y, w, h = c.content_coords()
+                total += w * h
+                lost += w * h - c.w * c.h
+        return lost / total
 
     def swap_photos(self, cell1, cell2):
         cell1.photo, cell2.photo = cell2.photo, cell1.photo
+
+
+def guess_no_cols(photolist, ratio):
+    """Returns a good number of columns to lay out photos
+
+    It depends on the ratio, the number of images and the average ratio of
+    these images. According to my calculations, the number of column should
+    be inversely proportional to the square root of the output image ratio,
+    and proportional to the square root of the average input images ratio.
+
+    """
+    avg_ratio = (sum(1.0 * photo.h / photo.w for photo in photolist) /
+                 len(photolist))
+    # Virtual number of images: since ~ 1 image over 3 is in a multi-cell
+    # (i.e. takes two columns), it takes the space of 4 images.
+    # So it's equivalent to 1/3 * 4 + 2/3 = 2 times the number of images.
+    virtual_no_imgs = 2 * len(photolist)
+    return max(1, int(round(math.sqrt(avg_ratio / ratio * virtual_no_imgs))))
+
+
+def split_photolist(photolist, no_pages=None, photos_per_page=20):
+    """Split photos into consecutive groups, one per page
+
+    If the number of pages is not given, it is the smallest one that puts at
+    most photos_per_page photos on each page. Photos are evenly spread across
+    pages, and their order is kept. There is no page if there is no photo.
+
+    """
+    if not photolist:
+        return []
+    if no_pages is None:
+        no_pages = math.ceil(len(photolist) / photos_per_page)
+    no_pages = max(1, min(no_pages, len(photolist)))
+    bounds = [len(photolist) * i // no_pages for i in range(no_pages + 1)]
+    return [photolist[bounds[i]:bounds[i + 1]] for i in range(no_pages)]
+
+
+def fill_page(photolist, ratio, no_cols, seed=None):
+    """Place photos in random order in a new page, without adjusting it
+
+    If a seed is given, the layout only depends on it, and the state of the
+    global random generator is left untouched.
+
+    """
+    if seed is not None:
+        state = random.getstate()
+        random.seed(seed)
+    try:
+        order = list(range(len(photolist)))
+        random.shuffle(order)
+        page = Page(1.0, ratio, no_cols)
+        for i in order:
+            page.add_cell(photolist[i])
+    finally:
+        if seed is not None:
+            random.setstate(state)
+    return page
+
+
+def score_layout(sizes, ratio, no_cols, seed):
+    """Returns the score of a candidate layout (lower is better)
+
+    The score is the fraction of photos' area lost by cropping, plus the
+    relative deviation from the target ratio before columns are stretched.
+    Only the (w, h) sizes of photos are needed, so that candidates can be
+    cheaply sent to other processes.
+
+    """
+    page = fill_page([Photo(None, w, h) for w, h in sizes],
+                     ratio, no_cols, seed)
+    page.remove_empty_cols()
+    page.remove_bottom_holes()
+    deviation = abs(page.ratio / ratio - 1)
+    page.adjust_cols_heights()
+    return page.crop_loss() + deviation
+
+
+def search_page(photolist, ratio, time_budget=0.5, max_candidates=32,
+                executor=None):
+    """Build several random layouts and return the best one, adjusted
+
+    Candidates use different seeds and column counts around
+    guess_no_cols(). They are scored with score_layout(), in parallel if a
+    concurrent.futures executor is given, until all are done or the time
+    budget (in seconds) is spent. The best candidate is then rebuilt here
+    from its seed.
+
+    """
+    deadline = time.time() + time_budget
+    no_cols = guess_no_cols(photolist, ratio)
+    sizes = [(photo.w, photo.h) for photo in photolist]
+    candidates = []
+    for i in range(max_candidates):
+        # no_cols, no_cols - 1, no_cols + 1, no_cols - 2, no_cols + 2...
+        offset = (i + 1) // 2 * (1 if i % 2 == 0 else -1)
+        candidates.append((max(1, no_cols + offset),
+                           random.randrange(2 ** 32)))
+
+    scores = {}
+    if executor is None:
+        for candidate in candidates:
+            if scores and time.time() > deadline:
+                break
+            scores[candidate] = score_layout(sizes, ratio, *candidate)
+    else:
+        import concurrent.futures
+
+        futures = {executor.submit(score_layout, sizes, ratio, *candidate):
+                   candidate for candidate in candidates}
+        done, not_done = concurrent.futures.wait(
+            futures, timeout=max(0, deadline - time.time()))
+        for future in not_done:
+            future.cancel()
+        for future in done:
+            if future.exception() is None:
+                scores[futures[future]] = future.result()
+
+    if scores:
+        best = min(scores, key=scores.get)
+    else:
+        best = candidates[0]
+    page = fill_page(photolist, ratio, *best)
+    page.adjust()
+    return page
+
+
+def make_block(sizes, ratio, no_cols, width, seed):
+    """Lay out one block of make_hierarchical_page()
+
+    Photos are given as (index, w, h) tuples, and the returned page contains
+    placeholder photos whose filename is this index. It is adjusted and
+    scaled to the given width, so that its height is width * ratio.
+
+    """
+    page = fill_page([Photo(i, w, h) for i, w, h in sizes],
+                     ratio, no_cols, seed)
+    page.adjust()
+    page.scale(width / page.w)
+    return page
+
+
+def make_hierarchical_page(photolist, ratio, block_size=2000,
+                           executor=None):
+    """Lay out a large number of photos block by block
+
+    Laying out tens of thousands of photos in a single page is slow, so
+    photos are split into blocks of about block_size photos. Each block is
+    laid out as an independent page (in parallel if a concurrent.futures
+    executor is given): a vertical strip as high as the final page, whose
+    width is proportional to its number of columns. Strips are then put side
+    by side in the final page. Cells never span two blocks.
+
+    """
+    order = list(range(len(photolist)))
+    random.shuffle(order)
+    no_blocks = max(1, int(round(len(photolist) / block_size)))
+    blocks = [order[i::no_blocks] for i in range(no_blocks)]
+
+    no_cols = guess_no_cols(photolist, ratio)
+    blocks_cols = [max(1, int(round(no_cols * len(b) / len(photolist))))
+                   for b in blocks]
+    total_cols = sum(blocks_cols)
+
+    args = []
+    for block, block_cols in zip(blocks, blocks_cols):
+        sizes = [(i, photolist[i].w, photolist[i].h) for i in block]
+        width = block_cols / total_cols
+        args.append((sizes, ratio / width, block_cols, width,
+                     random.randrange(2 ** 32)))
+    if executor is None:
+        sub_pages = [make_block(*a) for a in args]
+    else:
+        sub_pages = list(executor.map(make_block, *zip(*args)))
+
+    page = Page.__new__(Page)
+    page.target_ratio = ratio
+    page.cols = []
+    for sub_page in sub_pages:
+        for col in sub_page.cols:
+            col.parent = page
+            for c in col.cells:
+                if not c.is_extension():
+                    c.photo = photolist[c.photo.filename]
+            page.cols.append(col)
+    page.invalidate_cache()
+    page.adjust_cols_heights()
+    return page
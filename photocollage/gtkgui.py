@@ -14,19 +14,20 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import collections
 import copy
 import gettext
-from io import BytesIO
 import math
 import os.path
-import random
 import sys
+import time
 import urllib.parse
 
 import cairo
 import gi
 
-from photocollage import APP_NAME, artwork, collage, render
+from photocollage import APP_NAME, artwork, collage, history, render, \
+    thumbnails
 from photocollage.render import PIL_SUPPORTED_EXTS as EXTS
 
 gi.require_version('Gtk', '3.0')
@@ -50,15 +51,24 @@ gettext.install(APP_NAME, localedir=os.path.join(
 #   done
 
 
+# Pixel layout of cairo.FORMAT_RGB24: 32-bit native-endian integers, with
+# the upper 8 bits unused
+CAIRO_RGB24_RAWMODE = "BGRX" if sys.byteorder == "little" else "XRGB"
+
+
 def pil_image_to_cairo_surface(src):
-    # TODO: cairo.ImageSurface.create_for_data() is not yet available in
-    # Python 3, so we use PNG as an intermediate.
-    buf = BytesIO()
-    src.save(buf, "png")
-    buf.seek(0)
-    surface = cairo.ImageSurface.create_from_png(buf)
-    buf.close()
-    return surface
+    """Returns a cairo surface with the pixels of a PIL image
+
+    Pixels are packed once in cairo's layout, and the surface directly uses
+    this buffer.
+
+    """
+    if src.mode != "RGB":
+        src = src.convert("RGB")
+    w, h = src.size
+    data = bytearray(src.tobytes("raw", CAIRO_RGB24_RAWMODE))
+    return cairo.ImageSurface.create_for_data(data, cairo.FORMAT_RGB24, w, h,
+                                              4 * w)
 
 
 def get_all_save_image_exts():
@@ -119,12 +129,72 @@ def set_save_image_filters(dialog):
         dialog.add_filter(flt)
 
 
+# Processes used to search layouts, at most
+MAX_LAYOUT_SEARCH_WORKERS = 4
+
+# Below this number of photos, this process scores all candidate layouts
+# within the time budget: other processes are not needed
+PARALLEL_LAYOUT_SEARCH_THRESHOLD = 500
+
+_layout_search_executor = None
+_layout_search_warmup = []
+
+
+def start_layout_search_executor():
+    """Start a pool of processes to compute candidate layouts
+
+    Processes are spawned rather than forked, because forking a process that
+    runs GTK and other threads is not safe. Spawning them and importing the
+    layout code takes time, so it is done in background: the layout search
+    that starts the pool does not wait for it.
+
+    """
+    global _layout_search_executor
+    if _layout_search_executor is None:
+        import concurrent.futures
+        import importlib
+        import multiprocessing
+
+        no_workers = min(MAX_LAYOUT_SEARCH_WORKERS, os.cpu_count() or 1)
+        _layout_search_executor = concurrent.futures.ProcessPoolExecutor(
+            no_workers, mp_context=multiprocessing.get_context("spawn"))
+        _layout_search_warmup.extend(
+            _layout_search_executor.submit(importlib.import_module,
+                                           "photocollage.collage")
+            for i in range(no_workers))
+
+
+def get_layout_search_executor(photolist):
+    """Returns the pool of processes to lay out photos, or None
+
+    The pool is only started for the first large layout. Small layouts, and
+    large ones until its workers are started, are searched in this process.
+
+    """
+    if len(photolist) < PARALLEL_LAYOUT_SEARCH_THRESHOLD:
+        return None
+    start_layout_search_executor()
+    if not all(f.done() for f in _layout_search_warmup):
+        return None
+    return _layout_search_executor
+
+
 def gtk_run_in_main_thread(fn):
     def my_fn(*args, **kwargs):
         GObject.idle_add(fn, *args, **kwargs)
     return my_fn
 
 
+def gtk_update_channel():
+    """Returns a channel for calls from a RenderingTask to the main thread
+
+    Unlike with gtk_run_in_main_thread(), at most one progress update is
+    waiting for the main loop: older ones are dropped.
+
+    """
+    return render.UpdateChannel(GObject.idle_add)
+
+
 class UserCollage:
     """Represents a user-defined collage
 
@@ -135,32 +205,73 @@ class UserCollage:
     def __init__(self, photolist):
         self.photolist = photolist
 
+    @classmethod
+    def from_page(cls, page):
+        """Returns a collage of the photos laid out in a page"""
+        user_collage = cls([c.photo for col in page.cols for c in col.cells
+                            if not c.is_extension()])
+        user_collage.page = page
+        return user_collage
+
     def make_page(self, opts):
         # Define the output image height / width ratio
         ratio = 1.0 * opts.out_h / opts.out_w
 
-        # Compute a good number of columns. It depends on the ratio, the number
-        # of images and the average ratio of these images. According to my
-        # calculations, the number of column should be inversely proportional
-        # to the square root of the output image ratio, and proportional to the
-        # square root of the average input images ratio.
-        avg_ratio = (sum(1.0 * photo.h / photo.w for photo in self.photolist) /
-                     len(self.photolist))
-        # Virtual number of images: since ~ 1 image over 3 is in a multi-cell
-        # (i.e. takes two columns), it takes the space of 4 images.
-        # So it's equivalent to 1/3 * 4 + 2/3 = 2 times the number of images.
-        virtual_no_imgs = 2 * len(self.photolist)
-        no_cols = int(round(math.sqrt(avg_ratio / ratio * virtual_no_imgs)))
-
-        self.page = collage.Page(1.0, ratio, no_cols)
-        random.shuffle(self.photolist)
-        for photo in self.photolist:
-            self.page.add_cell(photo)
-        self.page.adjust()
+        if len(self.photolist) >= opts.hierarchical_layout_threshold:
+            # Too many photos to try several layouts: lay them out by blocks
+            self.page = collage.make_hierarchical_page(
+                self.photolist, ratio,
+                executor=get_layout_search_executor(self.photolist))
+        else:
+            # Try several random layouts and keep the one that crops photos
+            # the least
+            self.page = collage.search_page(
+                self.photolist, ratio, time_budget=opts.layout_search_time,
+                executor=get_layout_search_executor(self.photolist))
 
     def duplicate(self):
         return UserCollage(copy.copy(self.photolist))
 
+    def copy(self):
+        """Returns a copy of this collage and its layout, to be edited
+
+        Photo objects are shared between both copies, so they must not be
+        modified in place: see move_photo().
+
+        """
+        new_collage = UserCollage(copy.copy(self.photolist))
+        new_collage.page = self.page.copy()
+        return new_collage
+
+    def add_photos(self, photos, opts):
+        """Add photos to the current layout, without moving the other ones
+
+        Each column should receive at most one new photo, otherwise photos
+        get too squeezed: a new layout is made when more photos are added.
+
+        """
+        self.photolist.extend(photos)
+        if len(photos) <= self.page.no_cols:
+            self.page.add_photos(photos)
+        else:
+            self.make_page(opts)
+
+    def remove_photo(self, cell, opts):
+        """Remove the photo of a cell, keeping the rest of the layout
+
+        A new layout is made if the page cannot be fixed locally.
+
+        """
+        self.photolist.remove(cell.photo)
+        if self.page.remove_cell(cell) is None:
+            self.make_page(opts)
+
+    def move_photo(self, cell, x, y):
+        photo = copy.copy(cell.photo)
+        photo.move(x, y)
+        self.photolist[self.photolist.index(cell.photo)] = photo
+        cell.photo = photo
+
 
 class PhotoCollageWindow(Gtk.Window):
     TARGET_TYPE_TEXT = 1
@@ -168,8 +279,6 @@ class PhotoCollageWindow(Gtk.Window):
 
     def __init__(self):
         super().__init__(title=_("PhotoCollage"))
-        self.history = []
-        self.history_index = 0
 
         class Options:
             def __init__(self):
@@ -177,9 +286,37 @@ class PhotoCollageWindow(Gtk.Window):
                 self.border_c = "black"
                 self.out_w = 800
                 self.out_h = 600
+                self.layout_search_time = 0.5
+                self.hierarchical_layout_threshold = 10000
+                self.history_max_entries = 100
+                self.history_max_bytes = 64 * 1024 * 1024
+                # Render the poster while the user is idle, before it is
+                # saved. It is kept in memory, so it is off by default.
+                self.prerender_poster = False
+                # How photos are stored in render.cache (see ImageCache)
+                self.cache_policy = "raw"
+                # Add missing thumbnails to the cache shared with other
+                # desktop applications, when rendering the preview
+                self.write_thumbnails = False
 
         self.opts = Options()
 
+        self.history = history.History(
+            UserCollage.from_page, max_entries=self.opts.history_max_entries,
+            max_bytes=self.opts.history_max_bytes)
+        self.history_index = 0
+
+        render.cache.set_policy(self.opts.cache_policy)
+
+        self.preview_scheduler = render.RenderScheduler()
+        self.import_task = None
+        # Speculative rendering of the poster, at low priority. poster_key
+        # identifies the poster being rendered, and poster is its
+        # (key, image) once done.
+        self.poster_scheduler = render.RenderScheduler(delay=1.0, nice=10)
+        self.poster_key = None
+        self.poster = None
+
         self.make_window()
 
     def make_window(self):
@@ -262,6 +399,21 @@ class PhotoCollageWindow(Gtk.Window):
 
         box.pack_start(self.img_preview, True, True, 0)
 
+        self.preview_progress = Gtk.ProgressBar()
+        self.preview_progress.set_no_show_all(True)
+        box_window.pack_start(self.preview_progress, False, False, 0)
+
+        self.import_box = Gtk.Box(spacing=6)
+        self.import_box.set_no_show_all(True)
+        box_window.pack_start(self.import_box, False, False, 0)
+        self.import_progress = Gtk.ProgressBar()
+        self.import_progress.show()
+        self.import_box.pack_start(self.import_progress, True, True, 0)
+        btn_cancel_import = Gtk.Button.new_from_stock(Gtk.STOCK_CANCEL)
+        btn_cancel_import.connect("clicked", self.cancel_import)
+        btn_cancel_import.show()
+        self.import_box.pack_start(btn_cancel_import, False, False, 0)
+
         self.btn_save.set_sensitive(False)
 
         self.btn_undo.set_sensitive(False)
@@ -270,25 +422,94 @@ class PhotoCollageWindow(Gtk.Window):
         self.update_photolist([])
 
     def update_photolist(self, new_images):
-        try:
-            photolist = []
-            if self.history_index < len(self.history):
-                photolist = copy.copy(
-                    self.history[self.history_index].photolist)
-            photolist.extend(render.build_photolist(new_images))
-
-            if len(photolist) > 0:
-                new_collage = UserCollage(photolist)
-                new_collage.make_page(self.opts)
-                self.render_from_new_collage(new_collage)
-            else:
-                self.update_tool_buttons()
-        except render.BadPhoto as e:
-            dialog = ErrorDialog(
-                self, _("This image could not be opened:\n\"%(imgname)s\".")
-                % {"imgname": e.photoname})
-            dialog.run()
-            dialog.destroy()
+        if not new_images:
+            self.update_tool_buttons()
+            return
+
+        # Files are read in background. If an import is already running, it
+        # takes the new files too.
+        if self.import_task is not None \
+                and self.import_task.add_files(new_images):
+            return
+
+        # The collage made from the previous batch of this import
+        imported = None
+
+        def add_photos(photos):
+            nonlocal imported
+            imported = self.add_imported_photos(photos, imported)
+
+        def on_update(photos, fraction_complete):
+            self.import_progress.set_fraction(fraction_complete)
+            if t.scanner.no_dirs:
+                self.import_progress.set_text(
+                    _("%(no_files)d photos found (%(speed)d files/s)")
+                    % {"no_files": t.scanner.no_files,
+                       "speed": t.scanner.files_per_second()})
+                self.import_progress.set_show_text(True)
+            self.import_box.show()
+            add_photos(photos)
+
+        def on_complete(photos):
+            if self.import_task is t:
+                self.import_task = None
+                self.import_box.hide()
+                self.import_progress.set_show_text(False)
+            if photos:
+                add_photos(photos)
+            if t.scanner.truncated:
+                dialog = ErrorDialog(
+                    self,
+                    _("Some folders were not fully imported: they contain "
+                      "more than %(max_files)d photos, or more than "
+                      "%(max_depth)d levels of subfolders.")
+                    % {"max_files": t.scanner.max_files,
+                       "max_depth": t.scanner.max_depth})
+                dialog.run()
+                dialog.destroy()
+            if t.bad_files:
+                dialog = ErrorDialog(
+                    self,
+                    _("This image could not be opened:\n\"%(imgname)s\".")
+                    % {"imgname": t.bad_files[0]})
+                dialog.run()
+                dialog.destroy()
+
+        t = render.PhotoImportTask(
+            new_images,
+            on_update=gtk_run_in_main_thread(on_update),
+            on_complete=gtk_run_in_main_thread(on_complete))
+        self.import_task = t
+        t.start()
+
+    def add_imported_photos(self, photos, previous=None):
+        """Add photos to the current layout, and returns the new collage
+
+        Successive batches of an import replace the collage made from the
+        previous batch in history, unless the user went to another layout in
+        the meantime.
+
+        """
+        if self.history_index < len(self.history):
+            # Keep the current layout, and put new photos below
+            new_collage = self.history[self.history_index].copy()
+            new_collage.add_photos(photos, self.opts)
+        else:
+            new_collage = UserCollage(photos)
+            new_collage.make_page(self.opts)
+
+        if previous is not None and self.history_index < len(self.history) \
+                and self.history[self.history_index] is previous:
+            self.history[self.history_index] = new_collage
+            self.update_tool_buttons()
+            self.render_preview()
+        else:
+            self.render_from_new_collage(new_collage)
+        return new_collage
+
+    def cancel_import(self, button):
+        if self.import_task is not None:
+            self.import_task.abort()
 
     def choose_images(self, button):
         dialog = PreviewFileChooserDialog(title=_("Choose images"),
@@ -319,6 +540,12 @@ class PhotoCollageWindow(Gtk.Window):
     def render_preview(self):
         collage = self.history[self.history_index]
 
+        # The layout or the options changed: the poster rendered in
+        # background is not the one that will be saved
+        if self.poster_key is not None \
+                and self.poster_key != self.get_poster_key(collage):
+            self.cancel_poster_prerender()
+
         # If the desired ratio changed in the meantime (e.g. from landscape to
         # portrait), it needs to be re-updated
         collage.page.target_ratio = 1.0 * self.opts.out_h / self.opts.out_w
@@ -328,40 +555,45 @@ class PhotoCollageWindow(Gtk.Window):
         h = self.img_preview.get_allocation().height
         collage.page.scale_to_fit(w, h)
 
-        # Display a "please wait" dialog and do the job.
-        compdialog = ComputingDialog(self)
-
+        # Render in background, without blocking the window: if another
+        # preview is asked in the meantime, this one is dropped.
         def on_update(img, fraction_complete):
+            if t is not self.preview_scheduler.latest:
+                return
             self.img_preview.set_collage(img, collage)
-            compdialog.update(fraction_complete)
+            self.preview_progress.set_fraction(fraction_complete)
+            self.preview_progress.show()
 
         def on_complete(img):
+            if t is not self.preview_scheduler.latest:
+                return
             self.img_preview.set_collage(img, collage)
-            compdialog.destroy()
+            self.preview_progress.hide()
             self.btn_save.set_sensitive(True)
+            self.prerender_poster()
 
         def on_fail(exception):
+            if t is not self.preview_scheduler.latest:
+                return
+            self.preview_progress.hide()
             dialog = ErrorDialog(self, "{}:\n\n{}".format(
                 _("An error occurred while rendering image:"), exception))
-            compdialog.destroy()
             dialog.run()
             dialog.destroy()
             self.btn_save.set_sensitive(False)
 
+        self.img_preview.next_collage = collage
+        channel = gtk_update_channel()
         t = render.RenderingTask(
             collage.page,
             border_width=self.opts.border_w * max(collage.page.w,
                                                   collage.page.h),
-            border_color=self.opts.border_c,
-            on_update=gtk_run_in_main_thread(on_update),
-            on_complete=gtk_run_in_main_thread(on_complete),
-            on_fail=gtk_run_in_main_thread(on_fail))
-        t.start()
-
-        response = compdialog.run()
-        if response == Gtk.ResponseType.CANCEL:
-            t.abort()
-            compdialog.destroy()
+            border_color=self.opts.border_c, use_thumbnails=True,
+            write_thumbnails=self.opts.write_thumbnails,
+            on_update=channel.wrap(on_update),
+            on_complete=channel.wrap(on_complete),
+            on_fail=channel.wrap(on_fail))
+        self.preview_scheduler.request(t)
 
     def render_from_new_collage(self, collage):
         self.history.append(collage)
@@ -390,17 +622,64 @@ class PhotoCollageWindow(Gtk.Window):
         if response == Gtk.ResponseType.OK:
             dialog.apply_opts(self.opts)
             dialog.destroy()
+            render.cache.set_policy(self.opts.cache_policy)
             if self.history:
                 self.render_preview()
         else:
             dialog.destroy()
 
+    def get_poster_key(self, collage):
+        """Returns what identifies the poster of a collage"""
+        return (collage, self.opts.out_w, self.opts.out_h,
+                self.opts.border_w, self.opts.border_c)
+
+    def make_poster_task(self, collage, **kwargs):
+        # Work on a copy, so that the page in history keeps its preview size
+        page = collage.page.copy()
+
+        enlargement = float(self.opts.out_w) / page.w
+        page.scale(enlargement)
+
+        return render.RenderingTask(
+            page, border_width=self.opts.border_w * max(page.w, page.h),
+            border_color=self.opts.border_c,
+            quality=render.QUALITY_BALANCED, **kwargs)
+
+    def prerender_poster(self):
+        """Render the poster in background, so that saving it is fast
+
+        The task is only started after a delay without layout changes, and
+        it is cancelled by the next change.
+
+        """
+        if not self.opts.prerender_poster \
+                or self.history_index >= len(self.history):
+            if self.poster_key is not None:
+                self.cancel_poster_prerender()
+            return
+        key = self.get_poster_key(self.history[self.history_index])
+        if key == self.poster_key:
+            return
+
+        def on_complete(img):
+            if t is self.poster_scheduler.latest:
+                self.poster = (key, img)
+
+        channel = gtk_update_channel()
+        t = self.make_poster_task(self.history[self.history_index],
+                                  on_complete=channel.wrap(on_complete))
+        self.poster_key = key
+        self.poster = None
+        self.poster_scheduler.request(t)
+
+    def cancel_poster_prerender(self):
+        self.poster_scheduler.cancel()
+        self.poster_key = None
+        self.poster = None
+
     def save_poster(self, button):
         collage = self.history[self.history_index]
 
-        enlargement = float(self.opts.out_w) / collage.page.w
-        collage.page.scale(enlargement)
-
         dialog = Gtk.FileChooserDialog(_("Save image"), button.get_toplevel(),
                                        Gtk.FileChooserAction.SAVE)
         dialog.add_button(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL)
@@ -432,14 +711,20 @@ class PhotoCollageWindow(Gtk.Window):
             dialog.run()
             dialog.destroy()
 
-        t = render.RenderingTask(
-            collage.page, output_file=savefile,
-            border_width=self.opts.border_w * max(collage.page.w,
-                                                  collage.page.h),
-            border_color=self.opts.border_c,
-            on_update=gtk_run_in_main_thread(on_update),
-            on_complete=gtk_run_in_main_thread(on_complete),
-            on_fail=gtk_run_in_main_thread(on_fail))
+        channel = gtk_update_channel()
+        if self.poster is not None \
+                and self.poster[0] == self.get_poster_key(collage):
+            # Already rendered in background: only encoding is left
+            t = render.SavingTask(self.poster[1], savefile,
+                                  on_complete=channel.wrap(on_complete),
+                                  on_fail=channel.wrap(on_fail))
+        else:
+            # Do not render the same poster twice at the same time
+            self.cancel_poster_prerender()
+            t = self.make_poster_task(collage, output_file=savefile,
+                                      on_update=channel.wrap(on_update),
+                                      on_complete=channel.wrap(on_complete),
+                                      on_fail=channel.wrap(on_fail))
         t.start()
 
         response = compdialog.run()
@@ -460,6 +745,30 @@ class PhotoCollageWindow(Gtk.Window):
             self.history_index < len(self.history))
 
 
+class FrameStats:
+    """Durations of the last frames drawn by a widget"""
+    def __init__(self, size=100):
+        self.times = collections.deque(maxlen=size)
+        self.frames = 0
+        self.skipped = 0
+
+    def add(self, duration):
+        self.times.append(duration)
+        self.frames += 1
+
+    @property
+    def mean(self):
+        return sum(self.times) / len(self.times) if self.times else 0.0
+
+    @property
+    def max(self):
+        return max(self.times, default=0.0)
+
+    def __repr__(self):
+        return "%d frames (%d skipped), mean %.2f ms, max %.2f ms" % (
+            self.frames, self.skipped, 1000 * self.mean, 1000 * self.max)
+
+
 class ImagePreviewArea(Gtk.DrawingArea):
     """Area to display the poster preview and react to user actions"""
     INSENSITIVE, FLYING, SWAPPING_OR_MOVING = range(3)
@@ -485,7 +794,16 @@ class ImagePreviewArea(Gtk.DrawingArea):
                         Gdk.EventMask.POINTER_MOTION_MASK)
 
         self.image = None
+        # Copy of the image in a surface similar to the window's one, faster
+        # to paint
+        self.base = None
+        self.collage = None
+        # Collage being rendered, that will replace the displayed one
+        self.next_collage = None
         self.mode = self.INSENSITIVE
+        # Cell under the pointer
+        self.hovered = None
+        self.frame_stats = FrameStats()
 
         class SwapEnd:
             def __init__(self, cell=None, x=0, y=0):
@@ -499,16 +817,35 @@ class ImagePreviewArea(Gtk.DrawingArea):
 
     def set_collage(self, image, collage):
         self.image = pil_image_to_cairo_surface(image)
-        # The Collage object must be deeply copied.
-        # Otherwise, SWAPPING_OR_MOVING photos in a new page would also affect
-        # the original page (in history).
-        # The deep copy is done here (not in button_release_event) because
-        # references to cells are gathered in other functions, so that making
-        # the copy at the end would invalidate these references.
-        self.collage = copy.deepcopy(collage)
+        self.base = None
+        # The Collage object is not copied: it is the one in history. Editing
+        # it (SWAPPING_OR_MOVING or deleting photos) must be done on a copy,
+        # so that the original page is left unchanged.
+        self.collage = collage
         self.mode = self.FLYING
+        self.hovered = collage.page.get_cell_at_position(self.x, self.y)
         self.queue_draw()
 
+    def is_stale(self):
+        """Whether the displayed collage is about to be replaced
+
+        Until the new one is rendered, edits must be ignored: they would be
+        made on the displayed collage, and drop the changes of the new one.
+
+        """
+        return self.next_collage is not None \
+            and self.next_collage is not self.collage
+
+    def get_base_surface(self):
+        if self.base is None:
+            self.base = self.get_window().create_similar_surface(
+                cairo.CONTENT_COLOR, self.image.get_width(),
+                self.image.get_height())
+            context = cairo.Context(self.base)
+            context.set_source_surface(self.image, 0, 0)
+            context.paint()
+        return self.base
+
     def get_image_offset(self):
         return (round((self.get_allocation().width -
                        self.image.get_width()) / 2.0),
@@ -521,6 +858,22 @@ class ImagePreviewArea(Gtk.DrawingArea):
             return (int(round(x - x0)), int(round(y - y0)))
         return (int(round(x)), int(round(y)))
 
+    def get_cell_area(self, cell):
+        """Returns the area of the widget where a cell's border and delete
+        button are painted, as (x, y, w, h)"""
+        x0, y0 = self.get_image_offset()
+        x, y = x0 + cell.x, y0 + cell.y
+        # The delete button can overflow small cells
+        left = math.floor(min(x, x + cell.w - 20)) - 1
+        top = math.floor(y) - 1
+        right = math.ceil(x + cell.w) + 1
+        bottom = math.ceil(max(y + cell.h, y + 20)) + 1
+        return left, top, right - left, bottom - top
+
+    def queue_draw_cell(self, cell):
+        if cell is not None:
+            self.queue_draw_area(*self.get_cell_area(cell))
+
     def paint_image_border(self, context, cell, dash=None):
         x0, y0 = self.get_image_offset()
 
@@ -551,19 +904,21 @@ class ImagePreviewArea(Gtk.DrawingArea):
         context.stroke()
 
     def draw(self, widget, context):
+        start = time.perf_counter()
         if self.image is not None:
+            # Only the invalidated areas are painted, since the context is
+            # clipped to them
             x0, y0 = self.get_image_offset()
-            context.set_source_surface(self.image, x0, y0)
+            context.set_source_surface(self.get_base_surface(), x0, y0)
             context.paint()
 
+            cell = self.hovered
             if self.mode == self.FLYING:
-                cell = self.collage.page.get_cell_at_position(self.x, self.y)
                 if cell:
                     self.paint_image_border(context, cell)
                     self.paint_image_delete_button(context, cell)
             elif self.mode == self.SWAPPING_OR_MOVING:
                 self.paint_image_border(context, self.swap_origin.cell, (3, 3))
-                cell = self.collage.page.get_cell_at_position(self.x, self.y)
                 if cell and cell != self.swap_origin.cell:
                     self.paint_image_border(context, cell, (3, 3))
         else:
@@ -577,14 +932,25 @@ class ImagePreviewArea(Gtk.DrawingArea):
                        dnd_image.get_height()) / 2.0))
             context.paint()
 
+        self.frame_stats.add(time.perf_counter() - start)
         return False
 
     def motion_notify_event(self, widget, event):
         self.x, self.y = self.get_pos_in_image(event.x, event.y)
-        widget.queue_draw()
+        if self.mode == self.INSENSITIVE:
+            return
+
+        # Only repaint the previous and new hovered cells, if they changed
+        cell = self.collage.page.get_cell_at_position(self.x, self.y)
+        if cell is self.hovered:
+            self.frame_stats.skipped += 1
+            return
+        self.queue_draw_cell(self.hovered)
+        self.queue_draw_cell(cell)
+        self.hovered = cell
 
     def button_press_event(self, widget, event):
-        if self.mode == self.FLYING:
+        if self.mode == self.FLYING and not self.is_stale():
             x, y = self.get_pos_in_image(event.x, event.y)
             cell = self.collage.page.get_cell_at_position(x, y)
             if not cell:
@@ -592,10 +958,14 @@ class ImagePreviewArea(Gtk.DrawingArea):
             # Has the user clicked the delete button?
             dist = (cell.x + cell.w - 12 - x) ** 2 + (cell.y + 12 - y) ** 2
             if dist <= 8 * 8:
-                self.collage.photolist.remove(cell.photo)
-                if self.collage.photolist:
-                    self.collage.make_page(self.parent.opts)
-                    self.parent.render_from_new_collage(self.collage)
+                if len(self.collage.photolist) > 1:
+                    # Cells of the copied page are at the same positions as
+                    # the original ones
+                    new_collage = self.collage.copy()
+                    new_collage.remove_photo(
+                        new_collage.page.get_cell_at_position(x, y),
+                        self.parent.opts)
+                    self.parent.render_from_new_collage(new_collage)
                 else:
                     self.image = None
                     self.mode = self.INSENSITIVE
@@ -612,20 +982,32 @@ class ImagePreviewArea(Gtk.DrawingArea):
         if self.mode == self.SWAPPING_OR_MOVING:
             self.swap_dest.x, self.swap_dest.y = \
                 self.get_pos_in_image(event.x, event.y)
-            self.swap_dest.cell = self.collage.page.get_cell_at_position(
-                self.swap_dest.x, self.swap_dest.y)
+            self.swap_dest.cell = None
+            if not self.is_stale():
+                self.swap_dest.cell = self.collage.page.get_cell_at_position(
+                    self.swap_dest.x, self.swap_dest.y)
+            # Cells of the copied page are at the same positions as the
+            # original ones
             if self.swap_dest.cell \
                     and self.swap_origin.cell != self.swap_dest.cell:
                 # different cell: SWAPPING
-                self.collage.page.swap_photos(self.swap_origin.cell,
-                                              self.swap_dest.cell)
-                self.parent.render_from_new_collage(self.collage)
+                new_collage = self.collage.copy()
+                new_collage.page.swap_photos(
+                    new_collage.page.get_cell_at_position(
+                        self.swap_origin.x, self.swap_origin.y),
+                    new_collage.page.get_cell_at_position(
+                        self.swap_dest.x, self.swap_dest.y))
+                self.parent.render_from_new_collage(new_collage)
             elif self.swap_dest.cell:
                 # same cell: MOVING
                 move_x = (self.swap_origin.x - self.x) / self.swap_dest.cell.w
                 move_y = (self.swap_origin.y - self.y) / self.swap_dest.cell.h
-                self.swap_dest.cell.photo.move(move_x, move_y)
-                self.parent.render_from_new_collage(self.collage)
+                new_collage = self.collage.copy()
+                new_collage.move_photo(
+                    new_collage.page.get_cell_at_position(
+                        self.swap_dest.x, self.swap_dest.y),
+                    move_x, move_y)
+                self.parent.render_from_new_collage(new_collage)
             self.mode = self.FLYING
         widget.queue_draw()
 
@@ -694,6 +1076,22 @@ class SettingsDialog(Gtk.Dialog):
         self.cmb_template.connect("changed", apply_template)
         box.pack_start(self.cmb_template, False, False, 0)
 
+        self.chk_prerender = Gtk.CheckButton(
+            _("Prepare the poster in background, to save it faster"))
+        self.chk_prerender.set_active(parent.opts.prerender_poster)
+        vbox.pack_start(self.chk_prerender, False, False, 0)
+
+        box = Gtk.Box(spacing=6)
+        vbox.pack_start(box, False, False, 0)
+        box.pack_start(Gtk.Label(_("Photos kept in memory:"), xalign=0),
+                       True, True, 0)
+        self.cmb_cache = Gtk.ComboBoxText()
+        self.cmb_cache.append("raw", _("Uncompressed (fastest)"))
+        self.cmb_cache.append("zlib", _("Compressed"))
+        self.cmb_cache.append("jpeg", _("Compressed, lossy (smallest)"))
+        self.cmb_cache.set_active_id(parent.opts.cache_policy)
+        box.pack_start(self.cmb_cache, False, False, 0)
+
         vbox.pack_start(Gtk.SeparatorToolItem(), True, True, 0)
 
         label = Gtk.Label(xalign=0)
@@ -746,6 +1144,8 @@ class SettingsDialog(Gtk.Dialog):
         opts.out_h = int(self.etr_outh.get_text() or '1')
         opts.border_w = float(self.etr_border.get_text() or '0') / 100.0
         opts.border_c = self.colorbutton.get_rgba().to_string()
+        opts.prerender_poster = self.chk_prerender.get_active()
+        opts.cache_policy = self.cmb_cache.get_active_id() or "raw"
 
 
 class ComputingDialog(Gtk.Dialog):
@@ -809,6 +1209,11 @@ class PreviewFileChooserDialog(Gtk.FileChooserDialog):
         if filename is None or os.path.isdir(filename):
             self.set_preview_widget_active(False)
             return
+        # Use the thumbnail made by another application, if there is one
+        thumbnail = thumbnails.find(filename,
+                                    PreviewFileChooserDialog.PREVIEW_MAX_SIZE)
+        if thumbnail is not None:
+            filename = thumbnail[0]
         try:
             pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(
                 filename,
@@ -830,8 +1235,16 @@ def main():
     win.connect("delete-event", Gtk.main_quit)
     win.show_all()
 
-    # If arguments are given, treat them as input images
+    # If arguments are given, treat them as input images or folders
     if len(sys.argv) > 1:
         win.update_photolist(sys.argv[1:])
 
     Gtk.main()
+
+    if win.import_task is not None:
+        win.import_task.abort()
+    win.preview_scheduler.close()
+    win.poster_scheduler.close()
+
+    if _layout_search_executor is not None:
+        _layout_search_executor.shutdown(cancel_futures=True)
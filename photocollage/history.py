@@ -0,0 +1,198 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Memory-bounded list of successive layouts, for undo and redo.
+
+Pages are not kept as Page objects, but as compact immutable records: for
+each column, a (width, slots) tuple, where slots are (photo, h, span) tuples
+for cells, or the index of the origin in the previous column for cell
+extents. They are made by layoutfile.encode_cols(). Photo objects are never
+copied.
+
+Widths and heights are stored relatively to the page width, and rounded:
+pages are scaled to the window before being displayed and edited, and this
+must not make their records differ from the ones of their parent.
+
+Most edits (swapping or moving photos, removing a photo, adding a few ones)
+only change a few columns. When a layout is stored, its columns that are
+equal to columns of the previous layout reuse their records, so an entry
+only costs the columns that changed since its parent.
+
+When there are too many entries, or when they take too much memory, the
+oldest ones are dropped.
+
+"""
+
+import sys
+
+from photocollage.layoutfile import decode_cols, encode_cols
+
+
+# Significant digits kept for dimensions in records
+PRECISION = 10
+
+
+class HistoryEntry:
+    __slots__ = ("target_ratio", "w", "cols", "size")
+
+    def __init__(self, target_ratio, w, cols, size):
+        self.target_ratio = target_ratio
+        self.w = w
+        self.cols = cols
+        self.size = size
+
+    def photos(self):
+        return {slot[0] for w, slots in self.cols for slot in slots
+                if not isinstance(slot, int)}
+
+
+def scale_cols(cols, alpha, precision=None):
+    """Returns column records with all dimensions multiplied by alpha"""
+    if precision is None:
+        def scale(x):
+            return x * alpha
+    else:
+        def scale(x):
+            return float("%.*g" % (precision, x * alpha))
+
+    return tuple((scale(w), tuple(slot if isinstance(slot, int)
+                                  else (slot[0], scale(slot[1]), slot[2])
+                                  for slot in slots))
+                 for w, slots in cols)
+
+
+def record_size(record):
+    """Returns an estimation of the memory taken by a column record"""
+    w, slots = record
+    size = sys.getsizeof(record) + sys.getsizeof(w) + sys.getsizeof(slots)
+    for slot in slots:
+        size += sys.getsizeof(slot)
+        if not isinstance(slot, int):
+            size += sys.getsizeof(slot[1])
+    return size
+
+
+def photo_size(photo):
+    return sys.getsizeof(photo) + sys.getsizeof(photo.filename)
+
+
+def entry_size(entry, parent=None):
+    """Returns the memory taken by an entry
+
+    Column records and photos that the entry shares with its parent are not
+    counted.
+
+    """
+    parent_cols = set()
+    parent_photos = set()
+    if parent is not None:
+        parent_cols = {id(record) for record in parent.cols}
+        parent_photos = parent.photos()
+
+    size = 0
+    for record in entry.cols:
+        if id(record) in parent_cols:
+            continue
+        size += record_size(record)
+        for slot in record[1]:
+            if not isinstance(slot, int) and slot[0] not in parent_photos:
+                size += photo_size(slot[0])
+    return size
+
+
+class History:
+    """List of collages, of which only the pages are stored
+
+    Collages are created back from pages with factory(page). The collage
+    that was last appended or accessed is kept as is, so that getting it
+    again returns the same object.
+
+    """
+    def __init__(self, factory, max_entries=100, max_bytes=64 * 1024 * 1024):
+        self.factory = factory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = []
+        self.size = 0
+        self._live_entry = None
+        self._live_collage = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def __getitem__(self, i):
+        entry = self.entries[i]
+        if entry is not self._live_entry:
+            page = decode_cols(entry.target_ratio,
+                               scale_cols(entry.cols, entry.w))
+            self._live_entry = entry
+            self._live_collage = self.factory(page)
+        return self._live_collage
+
+    def __setitem__(self, i, collage):
+        if i < 0:
+            i += len(self.entries)
+        parent = self.entries[i - 1] if i > 0 else None
+        entry = self.make_entry(collage.page, parent)
+        self.size += entry.size - self.entries[i].size
+        self.entries[i] = entry
+        self._live_entry = entry
+        self._live_collage = collage
+        # The next entry does not share its records with the new one
+        if i + 1 < len(self.entries):
+            self.update_size(i + 1)
+
+    def append(self, collage):
+        """Add a collage, and drop the oldest ones if limits are exceeded"""
+        parent = self.entries[-1] if self.entries else None
+        entry = self.make_entry(collage.page, parent)
+        self.entries.append(entry)
+        self.size += entry.size
+        self._live_entry = entry
+        self._live_collage = collage
+
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries
+                                         or self.size > self.max_bytes):
+            self.size -= self.entries.pop(0).size
+            # The new oldest entry now owns the records it shared
+            self.update_size(0)
+
+    def update_size(self, i):
+        """Count again the size of an entry, whose parent changed"""
+        parent = self.entries[i - 1] if i > 0 else None
+        entry = self.entries[i]
+        self.size -= entry.size
+        entry.size = entry_size(entry, parent)
+        self.size += entry.size
+
+    def make_entry(self, page, parent=None):
+        """Encode a page, sharing unchanged column records with its parent
+
+        The size of an entry only counts what it does not share with its
+        parent: new column records and photos.
+
+        """
+        cols = scale_cols(encode_cols(page), 1 / page.w, PRECISION)
+        if parent is not None:
+            parent_cols = {record: record for record in parent.cols}
+            cols = tuple(parent_cols.get(record, record) for record in cols)
+        entry = HistoryEntry(page.target_ratio, page.w, cols, 0)
+        entry.size = entry_size(entry, parent)
+        return entry
@@ -0,0 +1,316 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Save and load page layouts, so that they can be rendered again later (or
+elsewhere) without scanning photos nor computing a new layout.
+
+Two formats are available: JSON, and a more compact binary one. Both store
+the same things:
+
+- the page's target ratio,
+- the photos (filename, size, orientation and offsets), each stored once,
+- for each column, its width and its cells from top to bottom. A cell is
+  stored as its photo index, its height and the number of columns it takes.
+  A cell extent is stored as the index of its origin in the previous column.
+
+Photo files are never opened when loading.
+
+"""
+
+import json
+import math
+import struct
+
+from photocollage.collage import Cell, CellExtent, Page, Photo
+
+
+FORMAT_VERSION = 1
+
+BINARY_MAGIC = b"PCLAYOUT"
+
+# Slot types in the binary format
+_CELL = 0
+_EXTENDED_CELL = 1
+_EXTENT = 2
+
+
+class BadLayoutFile(Exception):
+    pass
+
+
+def encode_cols(page, photo_key=None):
+    """Returns the page's columns, as (col_w, slots) tuples
+
+    Slots are (photo, h, span) tuples for cells, where photo is the cell's
+    photo, or photo_key(photo) if photo_key is given. For cell extents, they
+    are the index of the origin cell in the previous column.
+
+    """
+    cols = []
+    prev_cells_index = {}
+    for col in page.cols:
+        slots = []
+        cells_index = {}
+        for k, c in enumerate(col.cells):
+            cells_index[c] = k
+            if c.is_extension():
+                slots.append(prev_cells_index[c.origin])
+            else:
+                photo = c.photo if photo_key is None else photo_key(c.photo)
+                slots.append((photo, c.h, len(c.parents)))
+        cols.append((col.w, tuple(slots)))
+        prev_cells_index = cells_index
+    return tuple(cols)
+
+
+def decode_cols(target_ratio, cols, get_photo=None):
+    """Build a Page from its (col_w, slots) columns
+
+    This is the reverse of encode_cols(): if slots do not hold photos,
+    get_photo() is called to get them. Raises BadLayoutFile if the columns do
+    not describe a valid page.
+
+    """
+    page = Page(1.0, target_ratio, len(cols))
+    for i, (col, (w, slots)) in enumerate(zip(page.cols, cols)):
+        col.w = w
+        for slot in slots:
+            if isinstance(slot, int):
+                if i == 0:
+                    raise BadLayoutFile("cell extent in the first column")
+                prev_cells = page.cols[i - 1].cells
+                if not 0 <= slot < len(prev_cells):
+                    raise BadLayoutFile("cell extent of a missing cell")
+                origin = prev_cells[slot]
+                if origin.is_extension() or len(origin.parents) != 2 \
+                        or origin.extent is not None:
+                    raise BadLayoutFile("cell extent of a cell that does not "
+                                        "span into column %d" % i)
+                col.cells.append(CellExtent(origin))
+            else:
+                photo, h, span = slot
+                # Cells span one or two columns
+                if span not in (1, 2) or i + span > len(cols):
+                    raise BadLayoutFile("cell spanning %r columns from "
+                                        "column %d" % (span, i))
+                if get_photo is not None:
+                    photo = get_photo(photo)
+                cell = Cell(tuple(page.cols[i:i + span]), photo)
+                cell.h = h
+                col.cells.append(cell)
+        # Cells spanning into this column must have their extent in it
+        for c in page.cols[i - 1].cells if i > 0 else ():
+            if not c.is_extension() and len(c.parents) == 2 \
+                    and c.extent is None:
+                raise BadLayoutFile("cell without extent in column %d" % i)
+    page.invalidate_cache()
+    return page
+
+
+def to_dict(page):
+    photos = []
+    photos_index = {}
+
+    def photo_index(p):
+        if p not in photos_index:
+            photos_index[p] = len(photos)
+            photos.append([p.filename, p.w, p.h, p.orientation,
+                           p.offset_w, p.offset_h])
+        return photos_index[p]
+
+    cols = encode_cols(page, photo_index)
+    return {
+        "version": FORMAT_VERSION,
+        "target_ratio": page.target_ratio,
+        "photos": photos,
+        "cols": cols,
+    }
+
+
+def _check_number(value, what, minimum=None):
+    """Raises BadLayoutFile if value is not a finite number above minimum
+
+    If minimum is None, value must be strictly positive.
+
+    """
+    if not isinstance(value, (int, float)) or isinstance(value, bool) \
+            or not math.isfinite(value) \
+            or (value <= 0 if minimum is None else value < minimum):
+        raise BadLayoutFile("invalid %s: %r" % (what, value))
+
+
+def _make_photo(filename, w, h, orientation, offset_w, offset_h):
+    if not isinstance(filename, str):
+        raise BadLayoutFile("invalid photo filename: %r" % (filename,))
+    _check_number(w, "photo width")
+    _check_number(h, "photo height")
+    _check_number(orientation, "photo orientation", 0)
+    _check_number(offset_w, "photo offset", 0)
+    _check_number(offset_h, "photo offset", 0)
+    photo = Photo(filename, w, h, orientation)
+    photo.offset_w = offset_w
+    photo.offset_h = offset_h
+    return photo
+
+
+def _make_page(target_ratio, photos, cols):
+    """Build a Page from columns whose slots refer to photos by index
+
+    Dimensions are checked before building the page: column widths must be
+    positive, and cell heights must not be negative.
+
+    """
+    def get_photo(index):
+        if not 0 <= index < len(photos):
+            raise BadLayoutFile("missing photo %r" % index)
+        return photos[index]
+
+    _check_number(target_ratio, "target ratio")
+    for w, slots in cols:
+        _check_number(w, "column width")
+        for slot in slots:
+            if not isinstance(slot, int):
+                _check_number(slot[1], "cell height", 0)
+    return decode_cols(target_ratio, cols, get_photo)
+
+
+def from_dict(data):
+    if data.get("version") != FORMAT_VERSION:
+        raise BadLayoutFile("unsupported layout version: %r"
+                            % data.get("version"))
+    try:
+        photos = [_make_photo(*p) for p in data["photos"]]
+        return _make_page(data["target_ratio"], photos, data["cols"])
+    except (KeyError, IndexError, TypeError, ValueError,
+            ArithmeticError) as e:
+        raise BadLayoutFile("invalid layout: %s" % e)
+
+
+def dumps_json(page):
+    return json.dumps(to_dict(page), separators=(",", ":"))
+
+
+def loads_json(s):
+    try:
+        data = json.loads(s)
+    except ValueError as e:
+        raise BadLayoutFile("invalid JSON: %s" % e)
+    if not isinstance(data, dict):
+        raise BadLayoutFile("invalid layout")
+    return from_dict(data)
+
+
+def dumps_binary(page):
+    """Returns the layout in binary form
+
+    All numbers are little-endian. After the magic string come:
+    version (H), target ratio (d), number of photos (I), photos, number of
+    columns (I), columns.
+    Photo: filename length (I), UTF-8 filename, w (I), h (I),
+    orientation (B), offset_w (d), offset_h (d).
+    Column: width (d), number of slots (I), slots.
+    Slot: type (B), then photo index (I) and height (d) for cells, or the
+    index of the origin in the previous column (I) for cell extents.
+
+    """
+    data = to_dict(page)
+    chunks = [BINARY_MAGIC, struct.pack("<HdI", FORMAT_VERSION,
+                                        data["target_ratio"],
+                                        len(data["photos"]))]
+    for filename, w, h, orientation, offset_w, offset_h in data["photos"]:
+        name = filename.encode("utf-8")
+        chunks.append(struct.pack("<I", len(name)))
+        chunks.append(name)
+        chunks.append(struct.pack("<IIBdd", w, h, orientation,
+                                  offset_w, offset_h))
+    chunks.append(struct.pack("<I", len(data["cols"])))
+    for w, slots in data["cols"]:
+        chunks.append(struct.pack("<dI", w, len(slots)))
+        for slot in slots:
+            if isinstance(slot, int):
+                chunks.append(struct.pack("<BI", _EXTENT, slot))
+            else:
+                photo_index, h, span = slot
+                kind = _EXTENDED_CELL if span > 1 else _CELL
+                chunks.append(struct.pack("<BId", kind, photo_index, h))
+    return b"".join(chunks)
+
+
+def loads_binary(b):
+    if not b.startswith(BINARY_MAGIC):
+        raise BadLayoutFile("not a layout file")
+    try:
+        pos = len(BINARY_MAGIC)
+        version, target_ratio, no_photos = struct.unpack_from("<HdI", b, pos)
+        if version != FORMAT_VERSION:
+            raise BadLayoutFile("unsupported layout version: %r" % version)
+        pos += struct.calcsize("<HdI")
+
+        photos = []
+        for i in range(no_photos):
+            length, = struct.unpack_from("<I", b, pos)
+            pos += 4
+            filename = b[pos:pos + length].decode("utf-8")
+            pos += length
+            photos.append(_make_photo(filename,
+                                      *struct.unpack_from("<IIBdd", b, pos)))
+            pos += struct.calcsize("<IIBdd")
+
+        cols = []
+        no_cols, = struct.unpack_from("<I", b, pos)
+        pos += 4
+        for i in range(no_cols):
+            w, no_slots = struct.unpack_from("<dI", b, pos)
+            pos += struct.calcsize("<dI")
+            slots = []
+            for j in range(no_slots):
+                kind, index = struct.unpack_from("<BI", b, pos)
+                pos += struct.calcsize("<BI")
+                if kind == _EXTENT:
+                    slots.append(index)
+                else:
+                    h, = struct.unpack_from("<d", b, pos)
+                    pos += 8
+                    slots.append((index, h, 2 if kind == _EXTENDED_CELL
+                                  else 1))
+            cols.append((w, slots))
+
+        return _make_page(target_ratio, photos, cols)
+    except (struct.error, UnicodeDecodeError, IndexError,
+            ArithmeticError) as e:
+        raise BadLayoutFile("invalid layout: %s" % e)
+
+
+def save(page, filename, binary=False):
+    if binary:
+        with open(filename, "wb") as f:
+            f.write(dumps_binary(page))
+    else:
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(dumps_json(page))
+
+
+def load(filename):
+    """Load a layout saved with save(), in any format"""
+    with open(filename, "rb") as f:
+        content = f.read()
+    if content.startswith(BINARY_MAGIC):
+        return loads_binary(content)
+    try:
+        return loads_json(content.decode("utf-8"))
+    except UnicodeDecodeError:
+        raise BadLayoutFile("not a layout file")
@@ -14,25 +14,60 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import collections
+from io import BytesIO
+import os
 import random
-from threading import Thread
+import sys
+from threading import Condition, get_native_id, Lock, Thread
 import time
+import zlib
 
-import PIL.Image
-import PIL.ImageDraw
-import PIL.ImageFile
-
-from photocollage.collage import Photo
+from photocollage import renderplan, thumbnails
+from photocollage.collage import Photo, search_page, split_photolist
 
 
 QUALITY_SKEL = 0
 QUALITY_FAST = 1
 QUALITY_BEST = 2
+# Close to QUALITY_BEST, but faster: see BALANCED_RESAMPLING
+QUALITY_BALANCED = 3
+
+# Resampling of QUALITY_BALANCED, chosen from the scale factor: for each
+# minimum scale factor, a PIL filter and the reducing_gap given to resize(),
+# so that large reductions start with reduce(). See tests/test_resampling.py
+# for the quality and speed of each strategy.
+BALANCED_RESAMPLING = (
+    (4.0, "LANCZOS", 2.0),
+    (0.0, "BICUBIC", None),
+)
+
+
+# PIL is slow to import and is not needed to start the GUI: it is imported
+# by import_pil() when photos are first read or rendered.
+PIL = None
+_import_pil_lock = Lock()
+
+
+def _load_pil():
+    import PIL.Image
+    import PIL.ImageDraw
+    import PIL.ImageFile
+
+    # Try to continue even if the input file is corrupted.
+    # See issue at https://github.com/adrienverge/PhotoCollage/issues/65
+    PIL.ImageFile.LOAD_TRUNCATED_IMAGES = True
+    return PIL
 
 
-# Try to continue even if the input file is corrupted.
-# See issue at https://github.com/adrienverge/PhotoCollage/issues/65
-PIL.ImageFile.LOAD_TRUNCATED_IMAGES = True
+def import_pil():
+    # Threads may call this at the same time: the global is only set once
+    # all modules are imported and configured
+    global PIL
+    if PIL is None:
+        with _import_pil_lock:
+            if PIL is None:
+                PIL = _load_pil()
 
 
 class PIL_SUPPORTED_EXTS:
@@ -93,31 +128,323 @@ class BadPhoto(Exception):
         self.photoname = photoname
 
 
+def read_photo(name):
+    """Returns a Photo object for a file, reading only its header"""
+    import_pil()
+    try:
+        img = PIL.Image.open(name)
+    except OSError:
+        raise BadPhoto(name)
+    w, h = img.size
+
+    orientation = 0
+    try:
+        exif = img._getexif()
+        if 274 in exif:  # orientation tag
+            orientation = exif[274]
+            if orientation == 6 or orientation == 8:
+                w, h = h, w
+    except Exception:
+        pass
+
+    return Photo(name, w, h, orientation)
+
+
+def resize_image(img, size, resample, box=None):
+    """Resize an image, or a box of it, with a PIL filter given by its name
+
+    With "BALANCED", the filter is chosen from the scale factor, as in
+    BALANCED_RESAMPLING.
+
+    """
+    import_pil()
+    reducing_gap = None
+    if resample == "BALANCED":
+        x0, y0, x1, y1 = box if box is not None else (0, 0) + img.size
+        scale = min((x1 - x0) / size[0], (y1 - y0) / size[1])
+        for min_scale, resample, reducing_gap in BALANCED_RESAMPLING:
+            if scale >= min_scale:
+                break
+    return img.resize(size, getattr(PIL.Image, resample), box=box,
+                      reducing_gap=reducing_gap)
+
+
 def build_photolist(filelist):
-    ret = []
+    return [read_photo(name) for name in filelist]
+
+
+class DirectoryScanner:
+    """Find photos in directories, recursively
+
+    Directories are listed with os.scandir(), and files are only kept if
+    their extension is one of PIL_SUPPORTED_EXTS (they are not opened).
+    Hidden entries and symbolic links to directories are skipped.
+
+    Walking stops below max_depth levels of subdirectories, and once
+    max_files files were found: truncated is then set.
 
-    for name in filelist:
+    """
+    def __init__(self, max_depth=32, max_files=100000):
+        self.max_depth = max_depth
+        self.max_files = max_files
+        self.exts = {ext for exts in list(PIL_SUPPORTED_EXTS.RW.values()) +
+                     list(PIL_SUPPORTED_EXTS.RO.values()) for ext in exts}
+        self.no_files = 0
+        self.no_dirs = 0
+        self.truncated = False
+        self.scan_time = 0.0
+
+    def files_per_second(self):
+        return self.no_files / self.scan_time if self.scan_time else 0.0
+
+    def scan(self, path, depth=0):
+        """Returns the photos and the subdirectories of a directory
+
+        Subdirectories are only returned if they are not deeper than
+        max_depth, as (path, depth) tuples.
+
+        """
+        start = time.perf_counter()
+        files = []
+        subdirs = []
         try:
-            img = PIL.Image.open(name)
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
         except OSError:
-            raise BadPhoto(name)
-        w, h = img.size
+            entries = []
+        self.no_dirs += 1
+
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if depth < self.max_depth:
+                        subdirs.append((entry.path, depth + 1))
+                    else:
+                        self.truncated = True
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            ext = os.path.splitext(entry.name)[1][1:].lower()
+            if ext in self.exts:
+                if self.no_files >= self.max_files:
+                    self.truncated = True
+                    subdirs = []
+                    break
+                files.append(entry.path)
+                self.no_files += 1
+
+        self.scan_time += time.perf_counter() - start
+        return files, subdirs
+
+
+class PhotoImportTask(Thread):
+    """Execution thread to read photos from files in background
 
-        orientation = 0
+    Reading thousands of files takes time, so photos are given by batches to
+    on_update(photos, fraction_complete) as soon as they are read: the first
+    batch after `interval` seconds, then after twice as long each time, so
+    that users of the photos are not flooded. The last batch is given to
+    on_complete(photos), also called if the task was aborted.
+
+    Files can be added with add_files() while the task is running. Files
+    that cannot be opened are skipped and listed in bad_files.
+
+    Directories are walked by a DirectoryScanner, as they come: the photos
+    of a directory are read before its subdirectories are listed, and
+    no_files grows as photos are found.
+
+    """
+    def __init__(self, filelist, interval=0.5, on_update=None,
+                 on_complete=None, max_depth=32, max_files=100000):
+        super().__init__(daemon=True)
+
+        # Queue of (path, depth) tuples, where depth is the one of
+        # directories found by the scanner
+        self.files = collections.deque((name, 0) for name in filelist)
+        self.scanner = DirectoryScanner(max_depth, max_files)
+        self.interval = interval
+        self.no_files = len(filelist)
+        self.no_read = 0
+        self.bad_files = []
+
+        self.on_update = on_update
+        self.on_complete = on_complete
+
+        self.lock = Lock()
+        self.finished = False
+        self.canceled = False
+
+    def add_files(self, filelist):
+        """Add files to read, returns False if the task already finished"""
+        with self.lock:
+            if self.finished:
+                return False
+            self.files.extend((name, 0) for name in filelist)
+            self.no_files += len(filelist)
+            return True
+
+    def abort(self):
+        self.canceled = True
+
+    def run(self):
+        photos = []
+        interval = self.interval
+        last_update = time.time()
         try:
-            exif = img._getexif()
-            if 274 in exif:  # orientation tag
-                orientation = exif[274]
-                if orientation == 6 or orientation == 8:
-                    w, h = h, w
-        except Exception:
-            pass
+            while True:
+                with self.lock:
+                    if self.canceled or not self.files:
+                        self.finished = True
+                        break
+                    name, depth = self.files.popleft()
+
+                if os.path.isdir(name):
+                    files, subdirs = self.scanner.scan(name, depth)
+                    with self.lock:
+                        self.files.extendleft(reversed(
+                            [(f, depth) for f in files] + subdirs))
+                        self.no_files += len(files) + len(subdirs)
+                else:
+                    # Any error of a file (e.g. a decompression bomb) must
+                    # not stop the import
+                    try:
+                        photos.append(read_photo(name))
+                    except Exception:
+                        self.bad_files.append(name)
+                self.no_read += 1
+
+                now = time.time()
+                if photos and self.on_update \
+                        and now > last_update + interval:
+                    self.on_update(photos, self.no_read / self.no_files)
+                    photos = []
+                    interval *= 2
+                    last_update = now
+        finally:
+            # Even if the task failed, files cannot be added anymore and
+            # users must know that it is over
+            with self.lock:
+                self.finished = True
+            if self.on_complete:
+                self.on_complete(photos)
+
+
+class ImageCache:
+    """Resized photos, by file name, kept in memory
+
+    How images are stored depends on the policy:
+    - "raw": as PIL images, about 3 bytes per pixel
+    - "zlib": pixels compressed with zlib, lossless
+    - "jpeg", "webp": encoded with the given quality, lossy
+
+    Encoded images take much less memory, but they are decoded on each
+    access. Access times and memory use are counted, see report().
+
+    """
+    POLICIES = ("raw", "zlib", "jpeg", "webp")
+
+    def __init__(self, policy="raw", quality=90):
+        self.set_policy(policy, quality)
+        self.lock = Lock()
+        self.clear()
+
+    def set_policy(self, policy, quality=90):
+        """Change how new entries are stored"""
+        if policy not in self.POLICIES:
+            raise ValueError("unknown cache policy: %s" % policy)
+        self.policy = policy
+        self.quality = quality
+
+    def clear(self):
+        with self.lock:
+            # name -> (policy, mode, size, data, no_bytes)
+            self.entries = {}
+            self.no_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.hit_time = 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get_size(self, name):
+        """Returns the size of a cached image, without decoding it"""
+        entry = self.entries.get(name)
+        return entry[2] if entry is not None else None
+
+    def get(self, name, min_size=(0, 0)):
+        """Returns a cached image at least as large as min_size, or None"""
+        start = time.perf_counter()
+        entry = self.entries.get(name)
+        if entry is None or entry[2][0] < min_size[0] \
+                or entry[2][1] < min_size[1]:
+            with self.lock:
+                self.misses += 1
+            return None
+        img = self.decode(entry)
+        with self.lock:
+            self.hits += 1
+            self.hit_time += time.perf_counter() - start
+        return img
 
-        ret.append(Photo(name, w, h, orientation))
-    return ret
+    def __setitem__(self, name, img):
+        entry = self.encode(img)
+        with self.lock:
+            old = self.entries.get(name)
+            if old is not None:
+                self.no_bytes -= old[4]
+            self.entries[name] = entry
+            self.no_bytes += entry[4]
+
+    def encode(self, img):
+        import_pil()
+        if self.policy == "raw":
+            return ("raw", img.mode, img.size, img,
+                    img.size[0] * img.size[1] * len(img.getbands()))
+        if self.policy == "zlib":
+            data = zlib.compress(img.tobytes(), 1)
+        else:
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            buf = BytesIO()
+            img.save(buf, self.policy.upper(), quality=self.quality)
+            data = buf.getvalue()
+        return (self.policy, img.mode, img.size, data, len(data))
+
+    def decode(self, entry):
+        policy, mode, size, data, no_bytes = entry
+        if policy == "raw":
+            return data
+        import_pil()
+        if policy == "zlib":
+            return PIL.Image.frombytes(mode, size, zlib.decompress(data))
+        img = PIL.Image.open(BytesIO(data))
+        img.load()
+        return img
 
+    def report(self):
+        """Returns memory use and access times, as a string"""
+        with self.lock:
+            no_entries = len(self.entries)
+            return ("%d entries (%s), %.1f kB per entry, %d hits "
+                    "(%.3f ms each), %d misses" % (
+                        no_entries, self.policy,
+                        self.no_bytes / no_entries / 1024
+                        if no_entries else 0.0,
+                        self.hits,
+                        1000 * self.hit_time / self.hits
+                        if self.hits else 0.0,
+                        self.misses))
 
-cache = {}
+
+cache = ImageCache()
 
 
 class RenderingTask(Thread):
@@ -127,18 +454,39 @@ class RenderingTask(Thread):
     this, the program might be unresponding. To avoid this, rendering is done
     is a separated thread.
 
+    The page is compiled into a renderplan.RenderPlan when the task is
+    created, so it can be modified afterwards without disturbing rendering.
+
+    With use_thumbnails, photos are read from the thumbnails cache shared
+    with other desktop applications when a thumbnail is large enough. With
+    write_thumbnails too, missing thumbnails are added to it (see the
+    thumbnails module).
+
     """
     def __init__(self, page, border_width=0.01, border_color=(0, 0, 0),
-                 quality=QUALITY_FAST, output_file=None,
-                 on_update=None, on_complete=None, on_fail=None):
+                 quality=QUALITY_FAST, output_file=None, use_thumbnails=False,
+                 write_thumbnails=False, on_update=None, on_complete=None,
+                 on_fail=None):
         super().__init__()
+        import_pil()
 
         self.page = page
         self.border_width = border_width
         self.border_color = border_color
         self.quality = quality
 
+        if self.quality == QUALITY_FAST:
+            resample = "NEAREST"
+        elif self.quality == QUALITY_BALANCED:
+            resample = "BALANCED"
+        else:
+            resample = "LANCZOS"
+        self.plan = renderplan.compile_page(page, border_width, border_color,
+                                            resample)
+
         self.output_file = output_file
+        self.use_thumbnails = use_thumbnails
+        self.write_thumbnails = write_thumbnails
 
         self.on_update = on_update
         self.on_complete = on_complete
@@ -150,156 +498,123 @@ class RenderingTask(Thread):
         self.canceled = True
 
     def draw_skeleton(self, canvas):
-        for col in self.page.cols:
-            for c in col.cells:
-                if c.is_extension():
-                    continue
-                color = random_color()
-                x, y, w, h = c.content_coords()
-                xy = (x, y)
-                xY = (x, y + h - 1)
-                Xy = (x + w - 1, y)
-                XY = (x + w - 1, y + h - 1)
-
-                draw = PIL.ImageDraw.Draw(canvas)
-                draw.line(xy + Xy, fill=color)
-                draw.line(xy + xY, fill=color)
-                draw.line(xY + XY, fill=color)
-                draw.line(Xy + XY, fill=color)
-                draw.line(xy + XY, fill=color)
-                draw.line(xY + Xy, fill=color)
+        draw = PIL.ImageDraw.Draw(canvas)
+        for c in self.plan.cells:
+            color = random_color()
+            x, y, w, h = c.content_box()
+            xy = (x, y)
+            xY = (x, y + h - 1)
+            Xy = (x + w - 1, y)
+            XY = (x + w - 1, y + h - 1)
+
+            draw.line(xy + Xy, fill=color)
+            draw.line(xy + xY, fill=color)
+            draw.line(xY + XY, fill=color)
+            draw.line(Xy + XY, fill=color)
+            draw.line(xy + XY, fill=color)
+            draw.line(xY + Xy, fill=color)
         return canvas
 
     def draw_borders(self, canvas):
-        if self.border_width == 0:
-            return
-
-        W = self.page.w - 1
-        H = self.page.h - 1
-        border = self.border_width - 1
-        color = self.border_color
-
         draw = PIL.ImageDraw.Draw(canvas)
-        draw.rectangle((0, 0) + (border, H), color)
-        draw.rectangle((W - border, 0) + (W, H), color)
-        draw.rectangle((0, 0) + (W, border), color)
-        draw.rectangle((0, H - border) + (W, H), color)
-
-        for col in self.page.cols:
-            # Draw horizontal borders
-            for c in col.cells[1:]:
-                xy = (col.x, c.y - border / 2)
-                XY = (col.x + col.w, c.y + border / 2)
-                draw.rectangle(xy + XY, color)
-            # Draw vertical borders
-            if col.x > 0:
-                for c in col.cells:
-                    if not c.is_extension():
-                        xy = (col.x - border / 2, c.y)
-                        XY = (col.x + border / 2, c.y + c.h)
-                        draw.rectangle(xy + XY, color)
+        for rect in self.plan.borders:
+            draw.rectangle(rect, self.plan.border_color)
         return canvas
 
     def resize_photo(self, cell, use_cache=False):
+        """Returns the photo of a CellPlan, cropped to its destination size"""
+        w, h = cell.dest[2:]
+        left, top, right, bottom = cell.crop
+        # Size of the whole photo at the destination scale
+        full_size = (max(1, int(round(cell.size[0] * w / (right - left)))),
+                     max(1, int(round(cell.size[1] * h / (bottom - top)))))
+
         # If a thumbnail is already in cache, let's use it. But only if it is
         # bigger than what we need, because we don't want to lose quality.
-        if (use_cache and cell.photo.filename in cache and
-                cache[cell.photo.filename].size[0] >= int(round(cell.w)) and
-                cache[cell.photo.filename].size[1] >= int(round(cell.h))):
-            img = cache[cell.photo.filename].copy()
-        else:
-            img = PIL.Image.open(cell.photo.filename)
-
-            # Rotate image is EXIF says so
-            if cell.photo.orientation == 3:
-                img = img.rotate(180, expand=True)
-            elif cell.photo.orientation == 6:
-                img = img.rotate(270, expand=True)
-            elif cell.photo.orientation == 8:
-                img = img.rotate(90, expand=True)
-
-        if self.quality == QUALITY_FAST:
-            method = PIL.Image.NEAREST
-        else:
-            method = PIL.Image.ANTIALIAS
-
-        shape = img.size[0] * cell.h - img.size[1] * cell.w
-        if shape > 0:  # image is too thick
-            img = img.resize((int(round(cell.h * img.size[0] / img.size[1])),
-                              int(round(cell.h))), method)
-        elif shape < 0:  # image is too tall
-            img = img.resize((int(round(cell.w)),
-                              int(round(cell.w * img.size[1] / img.size[0]))),
-                             method)
-        else:
-            img = img.resize((int(round(cell.w)), int(round(cell.h))), method)
-
-        # Save this new image to cache (if it is larger than the previous one)
-        if (use_cache and (cell.photo.filename not in cache or
-                           cache[cell.photo.filename].size[0] < img.size[0])):
-            cache[cell.photo.filename] = img
-
-        if shape > 0:  # image is too thick
-            width_to_crop = img.size[0] - cell.w
-            img = img.crop((
-                int(round(width_to_crop * cell.photo.offset_w)),
-                0,
-                int(round(img.size[0] - width_to_crop *
-                    (1 - cell.photo.offset_w))),
-                int(round(cell.h))
-            ))
-        elif shape < 0:  # image is too tall
-            height_to_crop = img.size[1] - cell.h
-            img = img.crop((
-                0,
-                int(round(height_to_crop * cell.photo.offset_h)),
-                int(round(cell.w)),
-                int(round(img.size[1] - height_to_crop *
-                    (1 - cell.photo.offset_h)))
-            ))
-
+        img = cache.get(cell.filename, full_size) if use_cache else None
+        if img is None:
+            if self.use_thumbnails:
+                img = self.load_thumbnail(cell, max(full_size))
+
+            if img is None:
+                img = PIL.Image.open(cell.filename)
+
+                # Rotate image is EXIF says so
+                if cell.orientation == 3:
+                    img = img.rotate(180, expand=True)
+                elif cell.orientation == 6:
+                    img = img.rotate(270, expand=True)
+                elif cell.orientation == 8:
+                    img = img.rotate(90, expand=True)
+
+                if self.use_thumbnails and self.write_thumbnails:
+                    self.save_thumbnail(cell, img)
+                if use_cache:
+                    img = resize_image(img, full_size, cell.resample)
+
+            # Save a thumbnail to cache (if it is larger than the previous
+            # one)
+            cached_size = cache.get_size(cell.filename)
+            if use_cache and (cached_size is None or
+                              cached_size[0] < img.size[0]):
+                cache[cell.filename] = img
+
+        scale_w = img.size[0] / cell.size[0]
+        scale_h = img.size[1] / cell.size[1]
+        return resize_image(img, (w, h), cell.resample,
+                            box=(left * scale_w, top * scale_h,
+                                 right * scale_w, bottom * scale_h))
+
+    def load_thumbnail(self, cell, size):
+        """Returns a thumbnail from the desktop cache, or None"""
+        img = thumbnails.load(cell.filename, size)
+        # Thumbnails made by other applications may not be rotated
+        if img is not None and abs(img.size[0] * cell.size[1] - img.size[1]
+                                   * cell.size[0]) > max(cell.size):
+            return None
         return img
 
+    def save_thumbnail(self, cell, img):
+        # Even small cells get a large thumbnail, as used by file choosers.
+        # Photos smaller than the thumbnail are fast enough to read.
+        if max(img.size) >= dict(thumbnails.FLAVORS)["large"]:
+            thumbnails.save(cell.filename, img, "large")
+
     def paste_photo(self, canvas, cell, img):
-        canvas.paste(img, (int(round(cell.x)), int(round(cell.y))))
+        canvas.paste(img, cell.dest[:2])
         return canvas
 
     def run(self):
         try:
             canvas = PIL.Image.new(
-                "RGB", (int(self.page.w), int(self.page.h)), "white")
+                "RGB", (self.plan.w, self.plan.h), "white")
 
             self.draw_skeleton(canvas)
             self.draw_borders(canvas)
 
             if self.quality != QUALITY_SKEL:
-                n = sum([len([cell for cell in col.cells if not
-                              cell.is_extension()]) for col in self.page.cols])
+                n = len(self.plan.cells)
                 i = 0.0
                 if self.on_update:
                     self.on_update(canvas, 0.0)
                 last_update = time.time()
 
-                for col in self.page.cols:
-                    for c in col.cells:
-                        if self.canceled:  # someone clicked "abort"
-                            return
-
-                        if c.is_extension():
-                            continue
+                for c in self.plan.cells:
+                    if self.canceled:  # someone clicked "abort"
+                        return
 
-                        img = self.resize_photo(c, use_cache=True)
-                        self.paste_photo(canvas, c, img)
+                    img = self.resize_photo(c, use_cache=True)
+                    self.paste_photo(canvas, c, img)
 
-                        # Only needed for interactive rendering
-                        if self.on_update:
-                            self.draw_borders(canvas)
+                    # Only needed for interactive rendering
+                    if self.on_update:
+                        self.draw_borders(canvas)
 
-                        i += 1
-                        now = time.time()
-                        if self.on_update and now > last_update + 0.1:
-                            self.on_update(canvas, i / n)
-                            last_update = now
+                    i += 1
+                    now = time.time()
+                    if self.on_update and now > last_update + 0.1:
+                        self.on_update(canvas, i / n)
+                        last_update = now
 
                 self.draw_borders(canvas)
 
@@ -311,3 +626,256 @@ class RenderingTask(Thread):
         except Exception as e:
             if self.on_fail:
                 self.on_fail(e)
+
+
+class SavingTask(Thread):
+    """Execution thread to save an image that is already rendered
+
+    It takes the same callbacks as RenderingTask. Aborting it only prevents
+    on_complete from being called: the file is written anyway.
+
+    """
+    def __init__(self, canvas, output_file, on_complete=None, on_fail=None):
+        super().__init__()
+        self.canvas = canvas
+        self.output_file = output_file
+        self.on_complete = on_complete
+        self.on_fail = on_fail
+        self.canceled = False
+
+    def abort(self):
+        self.canceled = True
+
+    def run(self):
+        try:
+            self.canvas.save(self.output_file)
+            if self.on_complete and not self.canceled:
+                self.on_complete(self.canvas)
+        except Exception as e:
+            if self.on_fail:
+                self.on_fail(e)
+
+
+class UpdateChannel:
+    """Pass calls from a worker thread to another thread, latest call wins
+
+    Functions returned by wrap() do not run the wrapped function: the call
+    is stored, and deliver() is given to schedule (e.g. GObject.idle_add) to
+    be run by the other thread. At most one call is pending: a call made
+    before the previous one was delivered replaces it, and the previous one
+    is dropped.
+
+    This suits calls that carry the whole state, like the canvas given by a
+    RenderingTask to on_update, and whose last one is on_complete or
+    on_fail. It does not suit calls that each carry new data, like batches
+    of PhotoImportTask.
+
+    """
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.lock = Lock()
+        self.pending = None
+        self.posted = 0
+        self.dropped = 0
+
+    def post(self, fn, *args):
+        with self.lock:
+            scheduled = self.pending is not None
+            if scheduled:
+                self.dropped += 1
+            self.pending = (fn, args)
+            self.posted += 1
+        if not scheduled:
+            self.schedule(self.deliver)
+
+    def wrap(self, fn):
+        def post(*args):
+            self.post(fn, *args)
+        return post
+
+    def deliver(self):
+        with self.lock:
+            fn, args = self.pending
+            self.pending = None
+        fn(*args)
+        # Do not run again, when scheduled with GObject.idle_add()
+        return False
+
+
+class RenderScheduler:
+    """Run rendering tasks one at a time, dropping superseded ones
+
+    Tasks given to request() are not started at once: requests arriving
+    within `delay` seconds are coalesced, and only the last one is run. A
+    new request also aborts the task that is running, since its result is
+    not wanted anymore. So at most one task is running and one is waiting.
+
+    Tasks are run in a single background thread, whose priority is lowered
+    by `nice` (only on Linux, where threads have their own nice value). The
+    number of tasks that were replaced before starting (skipped) or aborted
+    while running (cancelled) is counted.
+
+    """
+    def __init__(self, delay=0.1, nice=0):
+        self.delay = delay
+        self.nice = nice
+        self.latest = None
+        self.requested = 0
+        self.skipped = 0
+        self.cancelled = 0
+        self.completed = 0
+
+        self._cond = Condition()
+        self._pending = None
+        self._running = None
+        self._requested_at = 0
+        self._closed = False
+        self._thread = Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def request(self, task):
+        """Schedule a task, replacing any task that is waiting or running"""
+        with self._cond:
+            self.latest = task
+            self.requested += 1
+            if self._pending is not None:
+                self.skipped += 1
+            if self._running is not None and not self._running.canceled:
+                self._running.abort()
+                self.cancelled += 1
+            self._pending = task
+            self._requested_at = time.monotonic()
+            self._cond.notify_all()
+
+    def idle(self):
+        """Returns whether no task is waiting or running"""
+        with self._cond:
+            return self._pending is None and self._running is None
+
+    def wait(self, timeout=None):
+        """Wait until no task is waiting or running
+
+        Returns False if the timeout expired before.
+
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._pending is None and self._running is None,
+                timeout)
+
+    def cancel(self):
+        """Abort the running task and drop the waiting one"""
+        with self._cond:
+            self.latest = None
+            self._cancel()
+            self._cond.notify_all()
+
+    def close(self):
+        """Abort the running task, drop the waiting one and stop"""
+        with self._cond:
+            self._closed = True
+            self._cancel()
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _cancel(self):
+        if self._pending is not None:
+            self.skipped += 1
+            self._pending = None
+        if self._running is not None and not self._running.canceled:
+            self._running.abort()
+            self.cancelled += 1
+
+    def _loop(self):
+        if self.nice and sys.platform.startswith("linux"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, get_native_id(),
+                               os.getpriority(os.PRIO_PROCESS, 0) + self.nice)
+            except OSError:
+                pass
+
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    if self._pending is None:
+                        self._cond.wait()
+                        continue
+                    remaining = (self._requested_at + self.delay -
+                                 time.monotonic())
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                task = self._running = self._pending
+                self._pending = None
+
+            task.run()
+
+            with self._cond:
+                self._running = None
+                if not task.canceled:
+                    self.completed += 1
+                self._cond.notify_all()
+
+
+class PageReport:
+    """Result of the rendering of one page by render_pages()"""
+    def __init__(self, filename, no_photos):
+        self.filename = filename
+        self.no_photos = no_photos
+        self.layout_time = 0.0
+        self.render_time = 0.0
+        self.error = None
+
+
+def render_pages(photolist, out_w, out_h, output_pattern, no_pages=None,
+                 photos_per_page=20, border_width=0.01, border_color=(0, 0, 0),
+                 quality=QUALITY_FAST, layout_time_budget=0.5,
+                 max_workers=None):
+    """Lay out photos on several pages and render them concurrently
+
+    Photos are split with split_photolist() and a layout is searched for each
+    page. Pages are then rendered in parallel threads (PIL releases the GIL
+    while decoding and resizing images), all sharing the same thumbnail
+    cache, and saved to output_pattern % page_number (starting at 1).
+
+    Returns a PageReport for each page, with its timings. If a page could
+    not be rendered, the other ones are still saved, then the first error is
+    raised.
+
+    """
+    import concurrent.futures
+
+    ratio = 1.0 * out_h / out_w
+    reports = []
+    tasks = []
+    pages_photos = split_photolist(photolist, no_pages, photos_per_page)
+    for i, photos in enumerate(pages_photos):
+        report = PageReport(output_pattern % (i + 1), len(photos))
+        start = time.time()
+        page = search_page(photos, ratio, time_budget=layout_time_budget)
+        page.scale(out_w / page.w)
+        report.layout_time = time.time() - start
+
+        def on_fail(exception, report=report):
+            report.error = exception
+
+        reports.append(report)
+        tasks.append(RenderingTask(
+            page, border_width=border_width * max(page.w, page.h),
+            border_color=border_color, quality=quality,
+            output_file=report.filename, on_fail=on_fail))
+
+    def render(task, report):
+        start = time.time()
+        task.run()
+        report.render_time = time.time() - start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        list(executor.map(render, tasks, reports))
+
+    for report in reports:
+        if report.error is not None:
+            raise report.error
+    return reports
@@ -0,0 +1,166 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Flat description of what to draw to render a page.
+
+A collage.Page is compiled once into a RenderPlan, which only contains
+integer pixel boxes: for each photo, the part of the file to show and where
+to paste it, plus the rectangles of the borders. Executing a plan (see
+render.RenderingTask) does not need the layout objects anymore, so plans can
+be sent to other threads or processes, or saved with to_dict().
+
+This module does not depend on PIL.
+
+"""
+
+
+class CellPlan:
+    """Instructions to render one photo
+
+    filename, orientation: the photo file, and its EXIF orientation
+    size: size of the photo once rotated, as (w, h)
+    crop: part of the rotated photo to show, as (left, top, right, bottom)
+    dest: where to paste it on the canvas, as (x, y, w, h)
+    resample: name of the PIL resampling filter, e.g. "NEAREST", or
+              "BALANCED" to choose it from the scale factor
+
+    """
+    __slots__ = ("filename", "orientation", "size", "crop", "dest",
+                 "resample")
+
+    def __init__(self, filename, orientation, size, crop, dest, resample):
+        self.filename = filename
+        self.orientation = orientation
+        self.size = size
+        self.crop = crop
+        self.dest = dest
+        self.resample = resample
+
+    def content_box(self):
+        """Returns the (x, y, w, h) box of the whole photo, if not cropped"""
+        left, top, right, bottom = self.crop
+        x, y, w, h = self.dest
+        scale_w = w / (right - left)
+        scale_h = h / (bottom - top)
+        return (x - left * scale_w, y - top * scale_h,
+                self.size[0] * scale_w, self.size[1] * scale_h)
+
+
+class RenderPlan:
+    """Everything needed to render a page
+
+    w, h: size of the canvas
+    cells: CellPlan objects, in drawing order
+    borders: (x0, y0, x1, y1) rectangles to fill with border_color
+
+    """
+    def __init__(self, w, h, cells, borders, border_color):
+        self.w = w
+        self.h = h
+        self.cells = cells
+        self.borders = borders
+        self.border_color = border_color
+
+
+def compile_cell(cell, resample):
+    photo = cell.photo
+    x0, y0 = int(round(cell.x)), int(round(cell.y))
+    x1, y1 = int(round(cell.x + cell.w)), int(round(cell.y + cell.h))
+
+    # Keep the largest part of the photo that has the cell's ratio
+    if photo.w * cell.h > photo.h * cell.w:  # photo is too thick
+        crop_w = photo.h * cell.w / cell.h
+        left = (photo.w - crop_w) * photo.offset_w
+        box = (left, 0, left + crop_w, photo.h)
+    else:  # photo is too tall
+        crop_h = photo.w * cell.h / cell.w
+        top = (photo.h - crop_h) * photo.offset_h
+        box = (0, top, photo.w, top + crop_h)
+    left, top, right, bottom = (int(round(v)) for v in box)
+
+    return CellPlan(photo.filename, photo.orientation, (photo.w, photo.h),
+                    (left, top, max(right, left + 1), max(bottom, top + 1)),
+                    (x0, y0, x1 - x0, y1 - y0), resample)
+
+
+def compile_borders(page, border_width):
+    if border_width == 0:
+        return []
+
+    W = page.w - 1
+    H = page.h - 1
+    border = border_width - 1
+
+    borders = [
+        (0, 0, border, H),
+        (W - border, 0, W, H),
+        (0, 0, W, border),
+        (0, H - border, W, H),
+    ]
+    for col in page.cols:
+        # Horizontal borders
+        for c in col.cells[1:]:
+            borders.append((col.x, c.y - border / 2,
+                            col.x + col.w, c.y + border / 2))
+        # Vertical borders
+        if col.x > 0:
+            for c in col.cells:
+                if not c.is_extension():
+                    borders.append((col.x - border / 2, c.y,
+                                    col.x + border / 2, c.y + c.h))
+    return borders
+
+
+def compile_page(page, border_width=0, border_color=(0, 0, 0),
+                 resample="NEAREST"):
+    """Compile a page, at its current scale, into a RenderPlan
+
+    Cells too small to cover a pixel are left out.
+
+    """
+    cells = []
+    for col in page.cols:
+        for c in col.cells:
+            if not c.is_extension():
+                cell = compile_cell(c, resample)
+                if cell.dest[2] > 0 and cell.dest[3] > 0:
+                    cells.append(cell)
+    return RenderPlan(int(page.w), int(page.h), cells,
+                      compile_borders(page, border_width), border_color)
+
+
+def to_dict(plan):
+    return {
+        "w": plan.w,
+        "h": plan.h,
+        "cells": [[c.filename, c.orientation, list(c.size), list(c.crop),
+                   list(c.dest), c.resample] for c in plan.cells],
+        "borders": [list(b) for b in plan.borders],
+        "border_color": plan.border_color,
+    }
+
+
+def from_dict(data):
+    cells = [CellPlan(filename, orientation, tuple(size), tuple(crop),
+                      tuple(dest), resample)
+             for filename, orientation, size, crop, dest, resample
+             in data["cells"]]
+    border_color = data["border_color"]
+    if isinstance(border_color, list):
+        border_color = tuple(border_color)
+    return RenderPlan(data["w"], data["h"], cells,
+                      [tuple(b) for b in data["borders"]], border_color)
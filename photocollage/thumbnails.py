@@ -0,0 +1,197 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Read and write thumbnails in the cache shared by desktop applications.
+
+See the freedesktop.org Thumbnail Managing Standard:
+https://specifications.freedesktop.org/thumbnail-spec/latest/
+
+Thumbnails are PNG files in ~/.cache/thumbnails/<flavor>/, named after the
+MD5 of the URI of the original file. They are valid if their Thumb::MTime
+text chunk matches the modification time of the original file.
+
+Thumbnails are assumed to be upright (EXIF orientation applied), as written
+by common desktop thumbnailers and by save().
+
+Validating a thumbnail only reads the first chunks of the PNG file, so this
+module does not need PIL, except to load or save images.
+
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+import urllib.parse
+
+
+# Flavors of thumbnails, and the size of their largest side
+FLAVORS = (
+    ("normal", 128),
+    ("large", 256),
+    ("x-large", 512),
+    ("xx-large", 1024),
+)
+
+# Flavors that save() writes: the larger ones were only added in later
+# versions of the specification, and not all applications clean them up
+WRITTEN_FLAVORS = ("normal", "large")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def get_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "thumbnails")
+
+
+def get_uri(filename):
+    # Same escaping as GLib's g_filename_to_uri(), so that names match the
+    # ones of other applications
+    return "file://" + urllib.parse.quote(os.path.abspath(filename),
+                                          safe="/!$&'()*+,;=:@")
+
+
+def get_path(filename, flavor, cache_dir=None):
+    name = hashlib.md5(get_uri(filename).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir or get_cache_dir(), flavor, name + ".png")
+
+
+def get_flavor(size):
+    """Returns the smallest flavor whose thumbnails are size pixels large"""
+    for flavor, max_size in FLAVORS:
+        if max_size >= size:
+            return flavor
+    return None
+
+
+def read_png_info(path):
+    """Returns the size of a PNG image, and its text chunks
+
+    Only the chunks before the image data are read.
+
+    """
+    size = None
+    text = {}
+    with open(path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            raise ValueError("not a PNG file")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, kind = struct.unpack(">I4s", header)
+            if kind in (b"IDAT", b"IEND"):
+                break
+            data = f.read(length)
+            f.seek(4, os.SEEK_CUR)  # CRC
+            if kind == b"IHDR":
+                size = struct.unpack(">II", data[:8])
+            elif kind == b"tEXt":
+                key, _, value = data.partition(b"\0")
+                text[key.decode("latin-1")] = value.decode("latin-1")
+    return size, text
+
+
+def find(filename, size, cache_dir=None):
+    """Look for a valid thumbnail whose largest side is at least size
+
+    Returns its path and its (w, h) size, or None if there is none.
+
+    """
+    try:
+        mtime = int(os.stat(filename).st_mtime)
+    except OSError:
+        return None
+    uri = get_uri(filename)
+
+    for flavor, max_size in FLAVORS:
+        if max_size < size:
+            continue
+        path = get_path(filename, flavor, cache_dir)
+        try:
+            thumb_size, text = read_png_info(path)
+        except (OSError, ValueError, struct.error):
+            continue
+        if thumb_size is None or max(thumb_size) < size:
+            continue
+        if text.get("Thumb::URI") != uri or \
+                text.get("Thumb::MTime") != str(mtime):
+            continue
+        return path, thumb_size
+    return None
+
+
+def load(filename, size, cache_dir=None):
+    """Returns a valid thumbnail, as a PIL image, or None"""
+    import PIL.Image
+
+    found = find(filename, size, cache_dir)
+    if found is None:
+        return None
+    try:
+        with PIL.Image.open(found[0]) as img:
+            return img.convert("RGB")
+    except OSError:
+        return None
+
+
+def save(filename, img, flavor, cache_dir=None):
+    """Save a thumbnail of a file, from its (upright) PIL image
+
+    Errors are ignored: the cache is only an optimization. Only the flavors
+    of WRITTEN_FLAVORS can be saved.
+
+    """
+    import PIL.Image
+    import PIL.PngImagePlugin
+
+    if flavor not in WRITTEN_FLAVORS:
+        raise ValueError("thumbnails of flavor %r are not written" % flavor)
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return
+    max_size = dict(FLAVORS)[flavor]
+    thumb = img.copy()
+    thumb.thumbnail((max_size, max_size), PIL.Image.LANCZOS)
+
+    info = PIL.PngImagePlugin.PngInfo()
+    info.add_text("Thumb::URI", get_uri(filename))
+    info.add_text("Thumb::MTime", str(int(stat.st_mtime)))
+    info.add_text("Thumb::Size", str(stat.st_size))
+    info.add_text("Thumb::Image::Width", str(img.size[0]))
+    info.add_text("Thumb::Image::Height", str(img.size[1]))
+    info.add_text("Software", "PhotoCollage")
+
+    path = get_path(filename, flavor, cache_dir)
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Write to a temporary file, so that other applications never see
+        # a partial thumbnail
+        fd, tmp = tempfile.mkstemp(suffix=".png",
+                                   dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                thumb.save(f, "PNG", pnginfo=info)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
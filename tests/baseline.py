@@ -0,0 +1,53 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Baselines of benchmarks, stored as JSON files in tests/baselines/.
+
+Benchmarks compare their results with the ones stored when the baseline was
+last updated. To update them after an intended change, run the tests with
+the PHOTOCOLLAGE_UPDATE_BASELINES environment variable set.
+
+"""
+
+import json
+import os
+import unittest
+
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+
+def get_path(name):
+    return os.path.join(BASELINES_DIR, name)
+
+
+def load_baseline(name, results):
+    """Returns the stored baseline, to compare with new results
+
+    When updating baselines, results are stored instead and the test is
+    skipped.
+
+    """
+    if os.environ.get("PHOTOCOLLAGE_UPDATE_BASELINES"):
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(get_path(name), "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        raise unittest.SkipTest("baseline %s updated" % name)
+
+    with open(get_path(name)) as f:
+        return json.load(f)
@@ -0,0 +1,86 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import copy
+import random
+import unittest
+
+from photocollage.collage import Page, Photo
+
+try:
+    from photocollage.arraylayout import ArrayLayout
+except ImportError:  # NumPy is not installed
+    ArrayLayout = None
+
+
+@unittest.skipIf(ArrayLayout is None, "requires NumPy")
+class TestArrayLayout(unittest.TestCase):
+    def make_page(self, seed, no_photos, no_cols):
+        random.seed(seed)
+        page = Page(1.0, 0.75, no_cols)
+        for i in range(no_photos):
+            page.add_cell(Photo("img", random.randint(5, 20),
+                                random.randint(5, 20)))
+        page.remove_empty_cols()
+        page.remove_bottom_holes()
+        return page
+
+    def assertSameLayout(self, page1, page2):
+        self.assertEqual(repr(page1), repr(page2))
+        self.assertAlmostEqual(page1.w, page2.w)
+        self.assertAlmostEqual(page1.h, page2.h)
+        for col1, col2 in zip(page1.cols, page2.cols):
+            self.assertAlmostEqual(col1.x, col2.x)
+            self.assertAlmostEqual(col1.w, col2.w)
+            for cell1, cell2 in zip(col1.cells, col2.cells):
+                self.assertAlmostEqual(cell1.y, cell2.y)
+                self.assertAlmostEqual(cell1.h, cell2.h)
+
+    def test_same_layouts(self):
+        for seed in range(5):
+            page = self.make_page(seed, 500, 20)
+            copied = copy.deepcopy(page)
+
+            page.adjust_cols_heights()
+            page.scale_to_fit(800, 600)
+
+            layout = ArrayLayout(copied)
+            layout.adjust_cols_heights()
+            layout.scale_to_fit(800, 600)
+            self.assertAlmostEqual(layout.w, page.w)
+            self.assertAlmostEqual(layout.h, page.h)
+            layout.update_page()
+
+            self.assertSameLayout(page, copied)
+
+    def test_coords(self):
+        page = self.make_page(42, 300, 12)
+        page.adjust_cols_heights()
+        page.scale(3.0)
+
+        x, y, w, h = ArrayLayout(page).coords()
+        cells = [c for col in page.cols for c in col.cells
+                 if not c.is_extension()]
+        self.assertEqual(len(cells), len(x))
+        for i, c in enumerate(cells):
+            self.assertAlmostEqual(x[i], c.x)
+            self.assertAlmostEqual(y[i], c.y)
+            self.assertAlmostEqual(w[i], c.w)
+            self.assertAlmostEqual(h[i], c.h)
+
+
+if __name__ == '__main__':
+    unittest.main()
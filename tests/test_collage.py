@@ -14,10 +14,15 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import pickle
+import random
 import unittest
 from unittest.mock import Mock, patch
 
-from photocollage.collage import Page, Photo
+from photocollage.collage import fill_page, make_hierarchical_page, Page, \
+    Photo, search_page, split_photolist
 
 
 class TestCollage(unittest.TestCase):
@@ -25,6 +30,10 @@ class TestCollage(unittest.TestCase):
         self.p1 = Mock()
         self.p2 = Mock()
 
+    def tearDown(self):
+        self.p1.stop()
+        self.p2.stop()
+
     def force_cell_position(self, pos):
         """Disable random in placing cells"""
         self.p1.stop()
@@ -75,6 +84,19 @@ class TestCollage(unittest.TestCase):
                   "                                  [10 50]")
         self.assertEqual(repr(page), wanted)
 
+    def test_next_free_col_candidates(self):
+        random.seed(0)
+        page = Page(1.0, 0.75, 6)
+        for i in range(200):
+            minimum = min(c.h for c in page.cols)
+            wanted = [c for c in page.cols if c.h == minimum]
+            with patch("random.choice",
+                       new=Mock(side_effect=lambda x: x[-1])) as choice:
+                col = page.next_free_col()
+            self.assertEqual(choice.call_args[0][0], wanted)
+            self.assertIs(col, wanted[-1])
+            page.add_cell(Photo("img", 10 + i % 3, 10 + i % 4))
+
     def test_remove_empty_cols(self):
         page = Page(1, 0.6, 100)
         self.prevent_cell_extension()
@@ -220,6 +242,277 @@ class TestCollage(unittest.TestCase):
                   "        [20 10-- ------]")
         self.assertEqual(repr(page), wanted)
 
+    def test_cached_coordinates(self):
+        random.seed(42)
+        page = Page(1.0, 0.75, 8)
+        for i in range(100):
+            page.add_cell(Photo("img", 10 + i % 7, 10 + i % 5))
+        page.adjust()
+        page.scale_to_fit(800, 600)
+
+        def check():
+            x = 0
+            for col in page.cols:
+                self.assertEqual(col.x, x)
+                x += col.w
+                y = 0
+                for cell in col.cells:
+                    if cell.is_extension():
+                        y = cell.origin.y
+                    self.assertEqual(cell.y, y)
+                    y += cell.h
+                self.assertEqual(col.h, y)
+            self.assertEqual(page.w, x)
+
+        check()
+        page.scale(2.0)
+        check()
+        page.target_ratio = 1.0
+        page.adjust_cols_heights()
+        check()
+
+    def test_cells_lookup(self):
+        random.seed(7)
+        page = Page(1.0, 0.75, 6)
+        for i in range(80):
+            page.add_cell(Photo("img", 10 + i % 7, 10 + i % 5))
+        page.adjust()
+        page.scale_to_fit(400, 300)
+
+        def cell_at(x, y):
+            for col in page.cols:
+                if col.x <= x < col.x + col.w:
+                    for cell in col.cells:
+                        if cell.y <= y < cell.y + cell.h:
+                            if cell.is_extension():
+                                return cell.origin
+                            return cell
+
+        def cells_in(x, y, w, h):
+            found = []
+            for col in page.cols:
+                for cell in col.cells:
+                    if cell.is_extension():
+                        cell = cell.origin
+                    if (cell.x < x + w and x < cell.x + cell.w and
+                            cell.y < y + h and y < cell.y + cell.h and
+                            cell not in found):
+                        found.append(cell)
+            return found
+
+        for x in range(-10, 410, 7):
+            for y in range(-10, 310, 7):
+                self.assertIs(page.get_cell_at_position(x, y),
+                              cell_at(x, y))
+        for x, y, w, h in ((0, 0, 400, 300), (-5, -5, 2, 2),
+                           (100, 50, 120, 90), (399, 0, 5, 300)):
+            self.assertEqual(set(page.get_cells_in_rect(x, y, w, h)),
+                             set(cells_in(x, y, w, h)))
+
+    def test_copy(self):
+        random.seed(3)
+        # Many columns: copying must not recurse from one to the next one
+        page = Page(1.0, 0.75, 400)
+        for i in range(2000):
+            page.add_cell(Photo("img%d" % i, 10 + i % 7, 10 + i % 5))
+        page.adjust()
+
+        for copied in (copy.deepcopy(page), pickle.loads(pickle.dumps(page))):
+            self.assertEqual(repr(copied), repr(page))
+            for col1, col2 in zip(page.cols, copied.cols):
+                self.assertIsNot(col1, col2)
+                self.assertIs(col2.parent, copied)
+                self.assertEqual(col1.x, col2.x)
+                for cell1, cell2 in zip(col1.cells, col2.cells):
+                    self.assertEqual(cell1.y, cell2.y)
+                    self.assertEqual(cell1.photo.filename,
+                                     cell2.photo.filename)
+                    self.assertEqual(cell1.is_extended(),
+                                     cell2.is_extended())
+
+    def test_hierarchical_page(self):
+        random.seed(2)
+        photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                  for i in range(1000)]
+        for executor in (None, ThreadPoolExecutor(2)):
+            page = make_hierarchical_page(photos, 0.75, block_size=150,
+                                          executor=executor)
+            placed = [c.photo for col in page.cols for c in col.cells
+                      if not c.is_extension()]
+            self.assertCountEqual(placed, photos)
+            self.assertAlmostEqual(page.w, 1.0)
+            for col in page.cols:
+                self.assertIs(col.parent, page)
+                self.assertAlmostEqual(col.h, 0.75)
+
+    def test_page_copy(self):
+        photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                  for i in range(100)]
+        page = fill_page(photos, 0.75, 8, seed=5)
+        page.adjust()
+        page.scale_to_fit(800, 600)
+        wanted = repr(page)
+
+        copied = page.copy()
+        self.assertEqual(repr(copied), wanted)
+        for col1, col2 in zip(page.cols, copied.cols):
+            self.assertIs(col2.parent, copied)
+            self.assertEqual(col1.x, col2.x)
+            for cell1, cell2 in zip(col1.cells, col2.cells):
+                self.assertIsNot(cell1, cell2)
+                self.assertIs(cell1.photo, cell2.photo)
+                self.assertEqual(cell1.y, cell2.y)
+                self.assertEqual(cell1.content_coords(),
+                                 cell2.content_coords())
+
+        cell1 = copied.get_cell_at_position(10, 10)
+        cell2 = copied.get_cell_at_position(700, 500)
+        copied.swap_photos(cell1, cell2)
+        copied.scale(2)
+        self.assertEqual(repr(page), wanted)
+        self.assertIsNot(page.get_cell_at_position(10, 10).photo,
+                         cell1.photo)
+
+    def check_adjusted(self, page, photos=None):
+        for col in page.cols:
+            self.assertAlmostEqual(col.h, page.w * page.target_ratio)
+            y = 0
+            for cell in col.cells:
+                self.assertGreater(cell.h, 1e-6)
+                if cell.is_extension():
+                    self.assertGreaterEqual(cell.y, y - 1e-9)
+                    y = cell.y
+                else:
+                    self.assertAlmostEqual(cell.y, y)
+                    self.assertIn(col, cell.parents)
+                y += cell.h
+        if photos is not None:
+            placed = [c.photo for col in page.cols for c in col.cells
+                      if not c.is_extension()]
+            self.assertCountEqual(placed, photos)
+
+    def test_remove_cell(self):
+        photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                  for i in range(100)]
+        page = fill_page(photos, 0.75, 8, seed=5)
+        page.adjust()
+        page.scale_to_fit(800, 600)
+
+        removed = 0
+        remaining = list(photos)
+        for photo in photos:
+            cell = next(c for col in page.cols for c in col.cells
+                        if c.photo is photo)
+            wanted = repr(page)
+            first = page.get_col_index(cell.parents[0])
+            left = [(c.y, c.h) for col in page.cols[:first]
+                    for c in col.cells]
+            adjusted = page.remove_cell(cell)
+            if adjusted is None:
+                self.assertEqual(repr(page), wanted)
+                continue
+            removed += 1
+            remaining.remove(photo)
+            self.assertIs(adjusted[0], cell.parents[0])
+            self.assertEqual([(c.y, c.h) for col in page.cols[:first]
+                              for c in col.cells], left)
+            self.check_adjusted(page, remaining)
+
+        self.assertGreater(removed, 50)
+
+    def test_remove_cell_next_to_extended_cells(self):
+        photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                  for i in range(100)]
+        for seed in range(30):
+            page = fill_page(photos, 0.75, 8, seed=seed)
+            page.adjust()
+            page.scale_to_fit(800, 600)
+            for photo in photos[:40]:
+                # Copy the cells, not the photos
+                copied = copy.deepcopy(page, {id(p): p for p in photos})
+                cell = next(c for col in copied.cols for c in col.cells
+                            if c.photo is photo)
+                if copied.remove_cell(cell) is not None:
+                    self.check_adjusted(
+                        copied, [p for p in photos if p is not photo])
+
+    def test_add_photos(self):
+        photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                  for i in range(60)]
+        page = fill_page(photos[:50], 0.75, 8, seed=5)
+        page.adjust()
+        page.scale_to_fit(800, 600)
+        cols = list(page.cols)
+
+        random.seed(4)
+        adjusted = page.add_photos(photos[50:])
+        self.assertTrue(adjusted)
+        self.assertEqual(page.cols, cols)
+        self.assertAlmostEqual(page.w, 800)
+        self.check_adjusted(page)
+        placed = [c.photo for col in page.cols for c in col.cells
+                  if not c.is_extension()]
+        self.assertCountEqual(placed, photos)
+
+        self.assertEqual(page.add_photos([]), [])
+
+    def test_add_photos_fills_columns(self):
+        photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                  for i in range(60)]
+        for seed in range(200):
+            page = fill_page(photos[:50], 0.75, 8, seed=seed)
+            page.adjust()
+            page.scale_to_fit(800, 600)
+            random.seed(seed)
+            page.add_photos(photos[50:])
+            self.check_adjusted(page, photos)
+
+    def test_split_photolist(self):
+        photos = list(range(10))
+        self.assertEqual(split_photolist(photos, photos_per_page=4),
+                         [[0, 1, 2], [3, 4, 5], [6, 7, 8, 9]])
+        self.assertEqual(split_photolist(photos, no_pages=2),
+                         [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]])
+        self.assertEqual(split_photolist(photos, no_pages=20),
+                         [[i] for i in photos])
+        self.assertEqual(split_photolist(photos, photos_per_page=100),
+                         [photos])
+        self.assertEqual(split_photolist([]), [])
+        self.assertEqual(split_photolist([], no_pages=3), [])
+
+    def test_crop_loss(self):
+        self.prevent_cell_extension()
+        page = Page(20, 0.5, 2)
+        page.add_cell(Photo("img", 10, 10))
+        page.add_cell(Photo("img", 10, 10))
+        page.adjust()
+        self.assertEqual(page.crop_loss(), 0)
+
+        page = Page(20, 0.5, 2)
+        page.add_cell(Photo("img", 10, 20))
+        page.add_cell(Photo("img", 10, 20))
+        page.adjust()
+        self.assertAlmostEqual(page.crop_loss(), 0.5)
+
+    def test_search_page(self):
+        photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                  for i in range(60)]
+
+        random.seed(1)
+        state = random.getstate()
+        page1 = fill_page(photos, 0.75, 6, seed=123)
+        page2 = fill_page(photos, 0.75, 6, seed=123)
+        self.assertEqual(repr(page1), repr(page2))
+        self.assertEqual(random.getstate(), state)
+
+        for executor in (None, ThreadPoolExecutor(2)):
+            page = search_page(photos, 0.75, time_budget=5,
+                               max_candidates=8, executor=executor)
+            placed = [c.photo for col in page.cols for c in col.cells
+                      if not c.is_extension()]
+            self.assertCountEqual(placed, photos)
+            self.assertAlmostEqual(page.ratio, 0.75)
+
 
 if __name__ == '__main__':
     unittest.main()
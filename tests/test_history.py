@@ -0,0 +1,145 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import unittest
+
+from photocollage.collage import fill_page, Photo
+from photocollage.history import History, photo_size, record_size
+
+
+class Collage:
+    def __init__(self, page):
+        self.page = page
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                       for i in range(200)]
+        self.page = fill_page(self.photos, 0.75, 12, seed=8)
+        self.page.adjust()
+        self.page.scale_to_fit(800, 600)
+
+    def test_restore(self):
+        history = History(Collage)
+        first = Collage(self.page)
+        history.append(first)
+        self.assertIs(history[0], first)
+
+        page = self.page.copy()
+        page.swap_photos(page.get_cell_at_position(10, 10),
+                         page.get_cell_at_position(790, 590))
+        second = Collage(page)
+        history.append(second)
+        self.assertEqual(len(history), 2)
+
+        restored = history[0]
+        self.assertIsNot(restored, first)
+        self.assertIs(history[0], restored)
+        self.assertEqual(repr(restored.page), repr(self.page))
+        # Dimensions are rounded to PRECISION significant digits
+        for col1, col2 in zip(restored.page.cols, self.page.cols):
+            self.assertAlmostEqual(col1.x, col2.x)
+            for cell1, cell2 in zip(col1.cells, col2.cells):
+                self.assertIs(cell1.photo, cell2.photo)
+                self.assertAlmostEqual(cell1.y, cell2.y)
+                self.assertEqual(cell1.is_extended(), cell2.is_extended())
+        self.assertIs(history[1].page.get_cell_at_position(10, 10).photo,
+                      self.page.get_cell_at_position(790, 590).photo)
+
+        history[1] = first
+        self.assertIs(history[1], first)
+        self.assertEqual(repr(history[0].page), repr(history[1].page))
+
+    def test_sharing(self):
+        history = History(Collage)
+        history.append(Collage(self.page))
+        page = self.page.copy()
+        page.swap_photos(page.get_cell_at_position(10, 10),
+                         page.get_cell_at_position(790, 590))
+        history.append(Collage(page))
+
+        first, second = history.entries
+        shared = sum(col1 is col2
+                     for col1, col2 in zip(first.cols, second.cols))
+        self.assertEqual(shared, len(first.cols) - 2)
+        self.assertLess(second.size, first.size / 4)
+        self.assertEqual(history.size, first.size + second.size)
+
+    def test_sharing_after_scaling(self):
+        # As in the application: pages are scaled to the window after being
+        # appended, and the next edit is made on a copy of the scaled page
+        history = History(Collage)
+        page = self.page
+        history.append(Collage(page))
+        for size in ((1000, 700), (640, 480), (640, 480)):
+            page.target_ratio = 0.75
+            page.adjust_cols_heights()
+            page.scale_to_fit(*size)
+            page = page.copy()
+            cell1 = page.get_cell_at_position(1, 1)
+            cell2 = page.get_cell_at_position(page.w - 1, page.h - 1)
+            page.swap_photos(cell1, cell2)
+            history.append(Collage(page))
+
+            parent, entry = history.entries[-2:]
+            shared = {id(record) for record in parent.cols}
+            new = [i for i, record in enumerate(entry.cols)
+                   if id(record) not in shared]
+            # Only the columns holding the swapped cells are new
+            self.assertEqual(new, sorted({page.get_col_index(c.parents[0])
+                                          for c in (cell1, cell2)}))
+
+    def test_limits(self):
+        history = History(Collage, max_entries=3)
+        for i in range(5):
+            history.append(Collage(fill_page(self.photos, 0.75, 10, seed=i)))
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.size,
+                         sum(entry.size for entry in history.entries))
+
+        history.max_bytes = history.entries[-1].size
+        last = Collage(self.page)
+        history.append(last)
+        self.assertEqual(len(history), 1)
+        self.assertIs(history[0], last)
+
+    def test_size_after_eviction(self):
+        def real_size(history):
+            records = {id(record): record for entry in history.entries
+                       for record in entry.cols}
+            photos = {slot[0] for record in records.values()
+                      for slot in record[1] if not isinstance(slot, int)}
+            return sum(record_size(record) for record in records.values()) \
+                + sum(photo_size(photo) for photo in photos)
+
+        history = History(Collage, max_entries=3)
+        page = self.page
+        for i in range(6):
+            page = page.copy()
+            page.swap_photos(page.get_cell_at_position(10 + 60 * i, 10),
+                             page.get_cell_at_position(790, 590 - 40 * i))
+            history.append(Collage(page))
+            self.assertEqual(history.size, real_size(history))
+        self.assertEqual(len(history), 3)
+
+        # Records shared with the replaced entry are now counted by the next
+        # one. They may be counted twice, but never missed.
+        history[1] = Collage(self.page)
+        self.assertEqual(history.size,
+                         sum(entry.size for entry in history.entries))
+        self.assertGreaterEqual(history.size, real_size(history))
+        self.assertLess(history.size, real_size(history) * 1.1)
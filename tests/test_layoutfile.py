@@ -0,0 +1,138 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import struct
+import tempfile
+import unittest
+
+from photocollage import layoutfile
+from photocollage.collage import fill_page, Photo
+
+
+class TestLayoutFile(unittest.TestCase):
+    def setUp(self):
+        photos = [Photo("/photos/img%d-é.jpg" % i, 10 + i % 7, 10 + i % 5,
+                        orientation=i % 9) for i in range(300)]
+        photos[3].move(0.2, -0.1)
+        self.page = fill_page(photos, 0.75, 12, seed=4)
+        self.page.adjust()
+        self.page.scale_to_fit(800, 600)
+
+    def assertSamePage(self, page):
+        self.assertEqual(repr(page), repr(self.page))
+        self.assertEqual(page.target_ratio, self.page.target_ratio)
+        for col1, col2 in zip(self.page.cols, page.cols):
+            self.assertEqual(col1.x, col2.x)
+            self.assertEqual(col1.w, col2.w)
+            for cell1, cell2 in zip(col1.cells, col2.cells):
+                self.assertEqual(cell1.y, cell2.y)
+                self.assertEqual(cell1.h, cell2.h)
+                self.assertEqual(cell1.is_extended(), cell2.is_extended())
+                for attr in ("filename", "w", "h", "orientation",
+                             "offset_w", "offset_h"):
+                    self.assertEqual(getattr(cell1.photo, attr),
+                                     getattr(cell2.photo, attr))
+        for col in page.cols:
+            for c in col.cells:
+                if c.is_extension():
+                    self.assertIs(c.origin.extent, c)
+                    self.assertIs(c.parents[0], c.origin.parents[1])
+
+    def test_json(self):
+        self.assertSamePage(
+            layoutfile.loads_json(layoutfile.dumps_json(self.page)))
+
+    def test_binary(self):
+        self.assertSamePage(
+            layoutfile.loads_binary(layoutfile.dumps_binary(self.page)))
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for binary in (False, True):
+                filename = os.path.join(tmp, "layout")
+                layoutfile.save(self.page, filename, binary=binary)
+                self.assertSamePage(layoutfile.load(filename))
+
+    def test_bad_files(self):
+        binary = layoutfile.dumps_binary(self.page)
+        for data in (binary[:-3], binary[:20]):
+            self.assertRaises(layoutfile.BadLayoutFile,
+                              layoutfile.loads_binary, data)
+        # Photo of zero width
+        data = bytearray(binary)
+        pos = len(layoutfile.BINARY_MAGIC) + struct.calcsize("<HdI")
+        pos += 4 + struct.unpack_from("<I", data, pos)[0]
+        struct.pack_into("<I", data, pos, 0)
+        self.assertRaises(layoutfile.BadLayoutFile,
+                          layoutfile.loads_binary, bytes(data))
+        for data in ("{", "[]", '{"version": 99}', '{"version": 1}'):
+            self.assertRaises(layoutfile.BadLayoutFile,
+                              layoutfile.loads_json, data)
+
+    def test_bad_structure(self):
+        photos = [["a.jpg", 100, 100, 0, 0.5, 0.5],
+                  ["b.jpg", 100, 100, 0, 0.5, 0.5]]
+        for cols in (
+                [[1.0, [[0, 1.0, 3]]]],  # span larger than the page
+                [[1.0, [[0, 1.0, 0]]]],  # empty span
+                [[1.0, [[0, 1.0, 2]]], [1.0, [[1, 1.0, 2]]]],
+                [[1.0, [0]]],  # extent in the first column
+                [[1.0, [[0, 1.0, 1]]], [1.0, [0]]],  # origin not extended
+                [[1.0, [[0, 1.0, 2]]], [1.0, [1]]],  # missing origin
+                [[1.0, [[0, 1.0, 2]]], [1.0, [0, 0]]],  # two extents
+                [[1.0, [[0, 1.0, 2]]], [1.0, [[1, 1.0, 1]]]],  # no extent
+                [[1.0, [[0, 1.0, 1]]], [1.0, [[-1, 1.0, 1]]]],
+                [[1.0, [[0, 1.0, 1]]], [1.0, [[2, 1.0, 1]]]]):
+            data = {"version": 1, "target_ratio": 1.0, "photos": photos,
+                    "cols": cols}
+            self.assertRaises(layoutfile.BadLayoutFile,
+                              layoutfile.from_dict, data)
+
+        cols = [[1.0, [[0, 1.0, 1]]]]
+        for photo in (["a.jpg", 0, 100, 0, 0.5, 0.5],
+                      ["a.jpg", 100, 0, 0, 0.5, 0.5],
+                      ["a.jpg", 100, -5, 0, 0.5, 0.5],
+                      ["a.jpg", "x", 100, 0, 0.5, 0.5],
+                      ["a.jpg", 100, float("nan"), 0, 0.5, 0.5],
+                      ["a.jpg", 100, 100, 0, "x", 0.5],
+                      [None, 100, 100, 0, 0.5, 0.5]):
+            data = {"version": 1, "target_ratio": 1.0, "photos": [photo],
+                    "cols": cols}
+            self.assertRaises(layoutfile.BadLayoutFile,
+                              layoutfile.from_dict, data)
+        for ratio, cols in (
+                (1.0, [["x", [[0, 1.0, 1]]]]),
+                (1.0, [[0, [[0, 1.0, 1]]]]),
+                (1.0, [[float("inf"), [[0, 1.0, 1]]]]),
+                (1.0, [[1.0, [[0, "x", 1]]]]),
+                (1.0, [[1.0, [[0, -1.0, 1]]]]),
+                (1.0, [[1.0, [[0, None, 1]]]]),
+                ("x", [[1.0, [[0, 1.0, 1]]]]),
+                (0, [[1.0, [[0, 1.0, 1]]]])):
+            data = {"version": 1, "target_ratio": ratio, "photos": photos,
+                    "cols": cols}
+            self.assertRaises(layoutfile.BadLayoutFile,
+                              layoutfile.from_dict, data)
+
+        data = {"version": 1, "target_ratio": 1.0, "photos": photos,
+                "cols": [[1.0, [[0, 1.0, 2]]], [1.0, [0, [1, 1.0, 1]]]]}
+        page = layoutfile.from_dict(data)
+        self.assertIs(page.cols[1].cells[0].origin, page.cols[0].cells[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,393 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+try:
+    import PIL.Image
+
+    from photocollage import collage, render
+except ImportError:  # Pillow is not installed
+    render = None
+
+
+@unittest.skipIf(render is None, "requires Pillow")
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.files = []
+        for i in range(10):
+            filename = os.path.join(self.tmp, "img%d.png" % i)
+            size = (40 + 10 * (i % 3), 40 + 10 * (i % 4))
+            color = (25 * i, 255 - 25 * i, 100)
+            PIL.Image.new("RGB", size, color).save(filename)
+            self.files.append(filename)
+        render.cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_render_pages(self):
+        photolist = render.build_photolist(self.files)
+        pattern = os.path.join(self.tmp, "page-%02d.png")
+        reports = render.render_pages(photolist, 120, 90, pattern,
+                                      photos_per_page=4, max_workers=2)
+
+        self.assertEqual([r.no_photos for r in reports], [3, 3, 4])
+        for i, report in enumerate(reports):
+            self.assertEqual(report.filename, pattern % (i + 1))
+            self.assertGreater(report.render_time, 0)
+            with PIL.Image.open(report.filename) as img:
+                self.assertEqual(img.size, (120, 90))
+
+        self.assertEqual(render.render_pages([], 120, 90, pattern), [])
+
+    def test_render_plan(self):
+        photolist = render.build_photolist(self.files)
+        page = collage.fill_page(photolist, 0.75, 3, seed=1)
+        page.adjust()
+        page.scale_to_fit(160, 120)
+        for quality in (render.QUALITY_SKEL, render.QUALITY_FAST,
+                        render.QUALITY_BEST, render.QUALITY_BALANCED):
+            output = os.path.join(self.tmp, "out.png")
+            errors = []
+            task = render.RenderingTask(page, border_width=2,
+                                        quality=quality, output_file=output,
+                                        on_fail=errors.append)
+            # The page can be changed once the task is created
+            page.scale(2)
+            task.run()
+            page.scale(0.5)
+            self.assertEqual(errors, [])
+            with PIL.Image.open(output) as img:
+                self.assertEqual(img.size, (160, 120))
+                if quality != render.QUALITY_SKEL:
+                    c = task.plan.cells[0]
+                    x, y, w, h = c.dest
+                    color = int(c.filename[-5]) * 25
+                    self.assertEqual(img.getpixel((x + w // 2, y + h // 2)),
+                                     (color, 255 - color, 100))
+
+    def test_update_channel(self):
+        photolist = render.build_photolist(self.files)
+        page = collage.fill_page(photolist, 0.75, 3, seed=1)
+        page.adjust()
+        page.scale_to_fit(160, 120)
+
+        # Nothing is delivered while the task runs, so only its last call
+        # must be kept
+        scheduled = []
+        calls = []
+        channel = render.UpdateChannel(scheduled.append)
+        task = render.RenderingTask(
+            page, border_width=2, quality=render.QUALITY_BEST,
+            on_update=channel.wrap(lambda img, fraction: calls.append(img)),
+            on_complete=channel.wrap(lambda img: calls.append("complete")))
+        task.run()
+        self.assertEqual(len(scheduled), 1)
+        self.assertGreaterEqual(channel.posted, 2)
+        self.assertEqual(channel.dropped, channel.posted - 1)
+        self.assertFalse(scheduled[0]())
+        self.assertEqual(calls, ["complete"])
+
+        channel.post(calls.append, "again")
+        self.assertEqual(len(scheduled), 2)
+        scheduled[1]()
+        self.assertEqual(calls, ["complete", "again"])
+
+    def test_import_pil(self):
+        loaded = render.PIL
+
+        def load_pil():
+            # Other threads must not see PIL before it is configured
+            self.assertIsNone(render.PIL)
+            return loaded
+
+        with patch("photocollage.render.PIL", None), \
+                patch("photocollage.render._load_pil", load_pil):
+            render.import_pil()
+            self.assertIs(render.PIL, loaded)
+        self.assertTrue(render.PIL.ImageFile.LOAD_TRUNCATED_IMAGES)
+
+    def test_import_task(self):
+        bad = os.path.join(self.tmp, "bad.png")
+        with open(bad, "w") as f:
+            f.write("not an image")
+
+        batches = []
+        task = render.PhotoImportTask(
+            self.files[:5] + [bad], interval=0,
+            on_update=lambda photos, fraction: batches.append(photos),
+            on_complete=batches.append)
+        self.assertTrue(task.add_files(self.files[5:]))
+        task.run()
+        self.assertFalse(task.add_files(self.files))
+
+        photos = [p for batch in batches for p in batch]
+        self.assertEqual([p.filename for p in photos], self.files)
+        self.assertEqual((photos[1].w, photos[1].h), (50, 50))
+        self.assertEqual(task.bad_files, [bad])
+        self.assertEqual(task.no_read, 11)
+        self.assertGreater(len(batches), 1)
+
+        batches = []
+        task = render.PhotoImportTask(self.files, on_complete=batches.append)
+        task.abort()
+        task.run()
+        self.assertEqual(batches, [[]])
+
+        # Unexpected errors of a file only skip it
+        def read_photo(name):
+            if name == self.files[2]:
+                raise ValueError("decompression bomb")
+            return collage.Photo(name, 10, 10)
+
+        batches = []
+        task = render.PhotoImportTask(self.files, on_complete=batches.append)
+        with patch("photocollage.render.read_photo", read_photo):
+            task.run()
+        self.assertEqual(task.bad_files, [self.files[2]])
+        self.assertEqual(len(batches[0]), len(self.files) - 1)
+
+        # Others end the task, which is still completed
+        batches = []
+        task = render.PhotoImportTask(
+            self.files, interval=0, on_complete=batches.append,
+            on_update=Mock(side_effect=RuntimeError("update failed")))
+        self.assertRaises(RuntimeError, task.run)
+        self.assertEqual(len(batches), 1)
+        self.assertFalse(task.add_files(self.files))
+
+    def test_import_directories(self):
+        # Photos of a directory come before the ones of its subdirectories
+        tree = [self.tmp, os.path.join(self.tmp, "a"),
+                os.path.join(self.tmp, "a", "b")]
+        for d in tree[1:]:
+            os.mkdir(d)
+            for f in self.files[:3]:
+                shutil.copy(f, d)
+        os.mkdir(os.path.join(self.tmp, ".hidden"))
+        shutil.copy(self.files[0], os.path.join(self.tmp, ".hidden"))
+        with open(os.path.join(self.tmp, "a", "notes.txt"), "w") as f:
+            f.write("not an image")
+
+        def import_photos(filelist, **kwargs):
+            batches = []
+            task = render.PhotoImportTask(filelist, interval=0,
+                                          on_complete=batches.append,
+                                          **kwargs)
+            task.run()
+            return [os.path.relpath(p.filename, self.tmp)
+                    for batch in batches for p in batch], task
+
+        names, task = import_photos([self.tmp, self.files[0]])
+        self.assertEqual(names, ["img%d.png" % i for i in range(10)] +
+                         [os.path.join("a", "img%d.png" % i)
+                          for i in range(3)] +
+                         [os.path.join("a", "b", "img%d.png" % i)
+                          for i in range(3)] + ["img0.png"])
+        self.assertEqual(task.bad_files, [])
+        self.assertEqual(task.no_read, task.no_files)
+        self.assertEqual((task.scanner.no_files, task.scanner.no_dirs),
+                         (16, 3))
+        self.assertFalse(task.scanner.truncated)
+        self.assertGreater(task.scanner.files_per_second(), 0)
+
+        names, task = import_photos([os.path.join(self.tmp, "a")],
+                                    max_depth=0)
+        self.assertEqual(names, [os.path.join("a", "img%d.png" % i)
+                                 for i in range(3)])
+        self.assertTrue(task.scanner.truncated)
+
+        names, task = import_photos([self.tmp], max_files=12)
+        self.assertEqual(len(names), 12)
+        self.assertTrue(task.scanner.truncated)
+
+    def test_saving_task(self):
+        photolist = render.build_photolist(self.files)
+        page = collage.fill_page(photolist, 0.75, 3, seed=1)
+        page.adjust()
+        page.scale_to_fit(160, 120)
+        images = []
+        render.RenderingTask(page, border_width=2,
+                             on_complete=images.append).run()
+
+        output = os.path.join(self.tmp, "out.png")
+        task = render.SavingTask(images[0], output,
+                                 on_complete=images.append)
+        task.run()
+        self.assertIs(images[1], images[0])
+        with PIL.Image.open(output) as img:
+            self.assertEqual(img.tobytes(), images[0].tobytes())
+
+        errors = []
+        render.SavingTask(images[0], os.path.join(self.tmp, "no", "out.png"),
+                          on_fail=errors.append).run()
+        self.assertEqual(len(errors), 1)
+
+    def test_compressed_cache(self):
+        photolist = render.build_photolist(self.files)
+        page = collage.fill_page(photolist, 0.75, 3, seed=1)
+        page.adjust()
+        page.scale_to_fit(160, 120)
+
+        def render_page():
+            images = []
+            render.RenderingTask(page, border_width=2,
+                                 on_complete=images.append).run()
+            return images[0].tobytes()
+
+        expected = render_page()
+        for policy in ("zlib", "jpeg"):
+            render.cache.clear()
+            render.cache.set_policy(policy)
+            try:
+                self.assertEqual(render_page(), expected)  # fills the cache
+                self.assertEqual(render.cache.hits, 0)
+                self.assertEqual(len(render.cache), len(self.files))
+                got = render_page()
+                self.assertEqual(render.cache.hits, len(self.files))
+                if policy == "zlib":
+                    self.assertEqual(got, expected)
+                else:
+                    self.assertLessEqual(
+                        max(abs(a - b) for a, b in zip(got, expected)), 8)
+            finally:
+                render.cache.set_policy("raw")
+
+
+@unittest.skipIf(render is None, "requires Pillow")
+class TestImageCache(unittest.TestCase):
+    def test_policies(self):
+        img = PIL.Image.new("RGB", (300, 200), (10, 20, 30))
+        img.paste((200, 100, 0), (0, 0, 150, 200))
+        for policy in render.ImageCache.POLICIES:
+            cache = render.ImageCache(policy, quality=95)
+            self.assertIsNone(cache.get("a"))
+            cache["a"] = img
+            self.assertIn("a", cache)
+            self.assertEqual(cache.get_size("a"), (300, 200))
+            self.assertIsNone(cache.get("a", (301, 200)))
+            got = cache.get("a", (300, 200))
+            self.assertEqual((got.mode, got.size), ("RGB", (300, 200)))
+            pixel = got.getpixel((50, 50))
+            self.assertTrue(all(abs(a - b) <= 4 for a, b
+                                in zip(pixel, (200, 100, 0))), pixel)
+            if policy in ("raw", "zlib"):
+                self.assertEqual(got.tobytes(), img.tobytes())
+            if policy == "raw":
+                self.assertEqual(cache.no_bytes, 300 * 200 * 3)
+            else:
+                self.assertLess(cache.no_bytes, 300 * 200 * 3 / 10)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+            # Replacing an entry
+            cache["a"] = img.resize((30, 20))
+            self.assertEqual(cache.get_size("a"), (30, 20))
+            self.assertEqual(len(cache), 1)
+            self.assertIn("1 entries (%s)" % policy, cache.report())
+            cache.clear()
+            self.assertEqual((len(cache), cache.no_bytes, cache.hits),
+                             (0, 0, 0))
+
+        self.assertRaises(ValueError, render.ImageCache, "png")
+
+
+class FakeTask:
+    def __init__(self, duration=0):
+        self.duration = duration
+        self.started = threading.Event()
+        self.done = False
+        self.canceled = False
+
+    def abort(self):
+        self.canceled = True
+
+    def run(self):
+        self.started.set()
+        end = time.monotonic() + self.duration
+        while time.monotonic() < end:
+            if self.canceled:
+                return
+            time.sleep(0.001)
+        self.done = True
+
+
+@unittest.skipIf(render is None, "requires Pillow")
+class TestRenderScheduler(unittest.TestCase):
+    def test_coalesce(self):
+        scheduler = render.RenderScheduler(delay=0.05)
+        tasks = [FakeTask() for i in range(5)]
+        for task in tasks:
+            scheduler.request(task)
+        self.assertTrue(scheduler.wait(5))
+        self.assertEqual([t.done for t in tasks], [False] * 4 + [True])
+        self.assertIs(scheduler.latest, tasks[-1])
+        self.assertEqual((scheduler.requested, scheduler.skipped,
+                          scheduler.cancelled, scheduler.completed),
+                         (5, 4, 0, 1))
+        scheduler.close()
+
+    def test_cancel_running(self):
+        scheduler = render.RenderScheduler(delay=0)
+        first = FakeTask(duration=10)
+        scheduler.request(first)
+        self.assertTrue(first.started.wait(5))
+        second = FakeTask(duration=0.01)
+        scheduler.request(second)
+        self.assertTrue(scheduler.wait(5))
+        self.assertTrue(first.canceled)
+        self.assertFalse(first.done)
+        self.assertTrue(second.done)
+        self.assertEqual((scheduler.skipped, scheduler.cancelled,
+                          scheduler.completed), (0, 1, 1))
+
+        third = FakeTask(duration=10)
+        scheduler.request(third)
+        self.assertTrue(third.started.wait(5))
+        scheduler.close()
+        self.assertTrue(third.canceled)
+        self.assertEqual(scheduler.cancelled, 2)
+
+    def test_cancel(self):
+        scheduler = render.RenderScheduler(delay=0, nice=5)
+        first = FakeTask(duration=10)
+        scheduler.request(first)
+        self.assertTrue(first.started.wait(5))
+        waiting = FakeTask()
+        scheduler.request(waiting)
+        scheduler.cancel()
+        self.assertTrue(scheduler.wait(5))
+        self.assertTrue(first.canceled)
+        self.assertFalse(waiting.started.is_set())
+        self.assertIsNone(scheduler.latest)
+
+        # The scheduler is still usable
+        second = FakeTask()
+        scheduler.request(second)
+        self.assertTrue(scheduler.wait(5))
+        self.assertTrue(second.done)
+        scheduler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
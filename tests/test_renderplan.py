@@ -0,0 +1,75 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import json
+import pickle
+import unittest
+
+from photocollage.collage import CellExtent, fill_page, Page, Photo
+from photocollage.renderplan import compile_page, from_dict, to_dict
+
+
+class TestRenderPlan(unittest.TestCase):
+    def test_compile_cells(self):
+        page = Page(200, 0.5, 2)
+        page.add_cell_single_col(page.cols[0], Photo("thick", 400, 100))
+        page.add_cell_single_col(page.cols[1], Photo("tall", 100, 400, 6))
+        page.cols[0].cells[0].h = page.cols[1].cells[0].h = 100
+        page.invalidate_cache()
+        page.cols[1].cells[0].photo.offset_h = 0
+
+        plan = compile_page(page)
+        self.assertEqual((plan.w, plan.h), (200, 100))
+        thick, tall = plan.cells
+        self.assertEqual(thick.filename, "thick")
+        self.assertEqual(thick.crop, (150, 0, 250, 100))
+        self.assertEqual(thick.dest, (0, 0, 100, 100))
+        self.assertEqual(thick.content_box(), (-150, 0, 400, 100))
+        self.assertEqual(tall.orientation, 6)
+        self.assertEqual(tall.crop, (0, 0, 100, 100))
+        self.assertEqual(tall.dest, (100, 0, 100, 100))
+        self.assertEqual(tall.resample, "NEAREST")
+
+    def test_compile_page(self):
+        photos = [Photo("img%d" % i, 10 + i % 7, 10 + i % 5)
+                  for i in range(50)]
+        page = fill_page(photos, 0.75, 6, seed=4)
+        page.adjust()
+        page.scale_to_fit(800, 600)
+
+        plan = compile_page(page, border_width=4, border_color=(1, 2, 3),
+                            resample="LANCZOS")
+        self.assertCountEqual([c.filename for c in plan.cells],
+                              [p.filename for p in photos])
+        for c in plan.cells:
+            left, top, right, bottom = c.crop
+            self.assertTrue(0 <= left < right <= c.size[0])
+            self.assertTrue(0 <= top < bottom <= c.size[1])
+            x, y, w, h = c.dest
+            self.assertTrue(0 <= x and x + w <= 800)
+            self.assertTrue(0 <= y and y + h <= 600)
+        horizontal = sum(len(col.cells) - 1 for col in page.cols)
+        vertical = sum(not isinstance(c, CellExtent)
+                       for col in page.cols[1:] for c in col.cells)
+        self.assertEqual(len(plan.borders), 4 + horizontal + vertical)
+
+        for copied in (from_dict(json.loads(json.dumps(to_dict(plan)))),
+                       pickle.loads(pickle.dumps(plan))):
+            self.assertEqual(to_dict(copied), to_dict(plan))
+            self.assertEqual(copied.border_color, (1, 2, 3))
+            self.assertEqual(copied.cells[0].crop, plan.cells[0].crop)
+
+        self.assertEqual(compile_page(page).borders, [])
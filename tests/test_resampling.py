@@ -0,0 +1,123 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Compare resampling strategies, for quality and speed.
+
+A synthetic image is downscaled by several factors with each strategy. The
+quality of the result is its PSNR against the LANCZOS result (in dB, higher
+is better), and its speed is the time taken relatively to LANCZOS. Results
+are stored in baselines/resampling.json, for reference when choosing a
+rendering quality. The test fails if the quality of a strategy drops
+compared to the baseline. Timings are not checked, since they depend on the
+machine.
+
+To update the baseline after an intended change, run:
+
+    PHOTOCOLLAGE_UPDATE_BASELINES=1 python -m unittest tests/test_resampling.py
+
+"""
+
+import math
+import time
+import unittest
+
+from tests.baseline import load_baseline
+
+try:
+    import PIL.Image
+    import PIL.ImageChops
+    import PIL.ImageStat
+
+    from photocollage import render
+except ImportError:  # Pillow is not installed
+    render = None
+
+
+BASELINE = "resampling.json"
+
+SIZE = (1600, 1200)
+SCALES = (1.1, 1.5, 2, 3, 5, 10, 20)
+STRATEGIES = ("NEAREST", "BILINEAR", "BICUBIC", "LANCZOS", "BALANCED")
+NO_RUNS = 5
+
+# Allowed PSNR loss before failing, in dB
+TOLERANCE = 0.5
+
+
+def make_image():
+    """Returns a detailed image, always the same"""
+    r = PIL.Image.effect_mandelbrot(SIZE, (-2.2, -1.2, 1.0, 1.2), 100)
+    g = PIL.Image.effect_mandelbrot(SIZE, (-0.8, -0.2, -0.6, 0.0), 200)
+    b = PIL.Image.linear_gradient("L").resize(SIZE)
+    return PIL.Image.merge("RGB", (r, g, b))
+
+
+def psnr(img, reference):
+    """Returns the peak signal-to-noise ratio of an image, in dB"""
+    stat = PIL.ImageStat.Stat(PIL.ImageChops.difference(img, reference))
+    mse = sum(stat.sum2) / (len(stat.sum2) * img.size[0] * img.size[1])
+    return 10 * math.log10(255 ** 2 / mse) if mse else float("inf")
+
+
+def run_benchmark():
+    img = make_image()
+    results = {}
+    for scale in SCALES:
+        size = (round(SIZE[0] / scale), round(SIZE[1] / scale))
+        times = {}
+        outputs = {}
+        for strategy in STRATEGIES:
+            best = float("inf")
+            for i in range(NO_RUNS):
+                t = time.perf_counter()
+                outputs[strategy] = render.resize_image(img, size, strategy)
+                best = min(best, time.perf_counter() - t)
+            times[strategy] = best
+        results[str(scale)] = {
+            strategy: {
+                "psnr": round(min(psnr(outputs[strategy],
+                                       outputs["LANCZOS"]), 99.0), 2),
+                "relative_time": round(times[strategy] / times["LANCZOS"],
+                                       2),
+            } for strategy in STRATEGIES
+        }
+    return {"size": list(SIZE), "scales": results}
+
+
+@unittest.skipIf(render is None, "requires Pillow")
+class TestResampling(unittest.TestCase):
+    def test_balanced(self):
+        img = PIL.Image.new("RGB", (400, 300), (10, 200, 30))
+        for size, box in (((40, 30), None), ((350, 250), None),
+                          ((30, 30), (100, 0, 400, 300)),
+                          ((600, 450), None)):
+            out = render.resize_image(img, size, "BALANCED", box=box)
+            self.assertEqual(out.size, size)
+            self.assertEqual(out.getpixel((size[0] // 2, size[1] // 2)),
+                             (10, 200, 30))
+
+    def test_quality(self):
+        results = run_benchmark()
+        baseline = load_baseline(BASELINE, results)
+        self.assertEqual(results["size"], baseline["size"])
+        for scale, strategies in baseline["scales"].items():
+            for strategy, wanted in strategies.items():
+                got = results["scales"][scale][strategy]
+                self.assertGreaterEqual(
+                    got["psnr"], wanted["psnr"] - TOLERANCE,
+                    "%s at 1/%s: PSNR is %.2f dB, it used to be %.2f dB"
+                    % (strategy, scale, got["psnr"], wanted["psnr"]))
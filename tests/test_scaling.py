@@ -0,0 +1,180 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Check how layout operations scale with the number of photos.
+
+Layouts of synthetic photos are built with fixed seeds, each operation is
+timed, and a time = c * n^k curve is fitted for each of them. The test fails
+if the exponent k of an operation grows too much compared to the baseline
+stored in baselines/layout_scaling.json: absolute times depend on the
+machine, but exponents should not.
+
+To update the baseline after an intended change, run:
+
+    PHOTOCOLLAGE_UPDATE_BASELINES=1 python -m unittest tests/test_scaling.py
+
+"""
+
+import math
+import random
+import time
+import unittest
+
+from tests.baseline import load_baseline
+
+from photocollage.collage import guess_no_cols, Page, Photo
+
+
+BASELINE = "layout_scaling.json"
+
+SIZES = (100, 1000, 10000, 50000)
+SEED = 42
+RATIO = 0.75
+NO_LOOKUPS = 2000
+
+# Allowed growth of the fitted exponent before failing. An operation
+# becoming asymptotically worse (e.g. O(log n) to O(n), or O(n) to O(n^2))
+# adds about 1 to its exponent, while timing noise stays well below this.
+TOLERANCE = 0.3
+
+COMPLEXITIES = (
+    ("O(1)", lambda n: 1),
+    ("O(log n)", lambda n: math.log(n)),
+    ("O(n)", lambda n: n),
+    ("O(n log n)", lambda n: n * math.log(n)),
+    ("O(n^2)", lambda n: n * n),
+)
+
+
+def make_photos(n, seed):
+    rnd = random.Random(seed)
+    return [Photo("img%d" % i, rnd.randint(100, 400), rnd.randint(100, 400))
+            for i in range(n)]
+
+
+def measure(n, seed=SEED):
+    """Returns the time taken by each operation on a layout of n photos
+
+    Lookups are timed once the cells index of each column is built, so their
+    time is the one of NO_LOOKUPS lookups on an already displayed page.
+
+    """
+    photos = make_photos(n, seed)
+    random.seed(seed)
+    times = {}
+
+    t = time.perf_counter()
+    page = Page(1.0, RATIO, guess_no_cols(photos, RATIO))
+    for photo in photos:
+        page.add_cell(photo)
+    times["add_cell"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    page.adjust()
+    times["adjust"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    repr(page)
+    times["repr"] = time.perf_counter() - t
+
+    page.scale_to_fit(4000, 3000)
+    rnd = random.Random(seed)
+    points = [(rnd.uniform(0, page.w), rnd.uniform(0, page.h))
+              for i in range(NO_LOOKUPS)]
+    for x, y in points:
+        page.get_cell_at_position(x, y)
+    t = time.perf_counter()
+    for x, y in points:
+        page.get_cell_at_position(x, y)
+    times["get_cell_at_position"] = time.perf_counter() - t
+
+    return times
+
+
+def fit_exponent(sizes, times):
+    """Returns k such that times are best fitted by c * n^k (least squares)"""
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(t) for t in times]
+    x_avg = sum(xs) / len(xs)
+    y_avg = sum(ys) / len(ys)
+    return (sum((x - x_avg) * (y - y_avg) for x, y in zip(xs, ys)) /
+            sum((x - x_avg) ** 2 for x in xs))
+
+
+def fit_complexity(sizes, times):
+    """Returns the name of the complexity class that best fits times
+
+    For each class f, times / f(n) should be constant: the class with the
+    smallest variance of log(times / f(n)) is chosen.
+
+    """
+    def variance(f):
+        ys = [math.log(t / f(n)) for n, t in zip(sizes, times)]
+        avg = sum(ys) / len(ys)
+        return sum((y - avg) ** 2 for y in ys)
+
+    return min(COMPLEXITIES, key=lambda c: variance(c[1]))[0]
+
+
+def run_benchmark(sizes=SIZES):
+    """Returns measured times and fitted curves, as stored in the baseline
+
+    Small layouts are measured several times (keeping the best time) since
+    they are more sensitive to noise.
+
+    """
+    results = {}
+    for n in sizes:
+        runs = [measure(n) for i in range(max(1, min(5, 20000 // n)))]
+        for op in runs[0]:
+            results.setdefault(op, []).append(min(r[op] for r in runs))
+
+    return {
+        "sizes": list(sizes),
+        "seed": SEED,
+        "operations": {
+            op: {
+                "times": times,
+                "exponent": round(fit_exponent(sizes, times), 3),
+                "complexity": fit_complexity(sizes, times),
+            } for op, times in results.items()
+        },
+    }
+
+
+class TestScaling(unittest.TestCase):
+    def test_fit(self):
+        sizes = (10, 100, 1000)
+        self.assertAlmostEqual(fit_exponent(sizes, [2 * n for n in sizes]), 1)
+        self.assertAlmostEqual(
+            fit_exponent(sizes, [3e-3 * n ** 2 for n in sizes]), 2)
+        self.assertEqual(fit_complexity(sizes, [5, 5, 5]), "O(1)")
+        self.assertEqual(
+            fit_complexity(sizes, [n * math.log(n) for n in sizes]),
+            "O(n log n)")
+
+    def test_scaling(self):
+        results = run_benchmark()
+        baseline = load_baseline(BASELINE, results)
+        self.assertEqual(results["sizes"], baseline["sizes"])
+        for op, wanted in baseline["operations"].items():
+            got = results["operations"][op]
+            self.assertLessEqual(
+                got["exponent"], wanted["exponent"] + TOLERANCE,
+                "%s scales as n^%.2f (%s), it used to be n^%.2f (%s)"
+                % (op, got["exponent"], got["complexity"],
+                   wanted["exponent"], wanted["complexity"]))
@@ -0,0 +1,117 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Check that the application starts fast enough.
+
+Imports are timed in fresh interpreters, so that modules already loaded by
+other tests do not hide their cost. The time to first paint of the window is
+only measured when GTK and a display are available.
+
+"""
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+
+# Modules needed to show the window. The GUI itself is only added when GTK is
+# available.
+STARTUP_MODULES = ["photocollage.collage", "photocollage.history",
+                   "photocollage.renderplan", "photocollage.render",
+                   "photocollage.thumbnails"]
+
+# Modules that are slow to import, and must only be loaded on first use
+LAZY_MODULES = ["PIL", "concurrent.futures", "multiprocessing"]
+
+# Budgets, in seconds. They are generous, to leave room for slow machines:
+# exceeding them means that something heavy was added to the startup path.
+IMPORT_BUDGET = 0.25
+FIRST_PAINT_BUDGET = 5.0
+
+NO_RUNS = 3
+
+
+def has_gtk():
+    return importlib.util.find_spec("gi") is not None and bool(
+        os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+# Runs the application, with a window that quits once it is painted
+FIRST_PAINT_CODE = """
+from gi.repository import GObject, Gtk
+from photocollage import gtkgui
+
+class Window(gtkgui.PhotoCollageWindow):
+    def __init__(self):
+        super().__init__()
+        self.first_paint = self.img_preview.connect_after(
+            "draw", self.on_first_paint)
+
+    def on_first_paint(self, widget, context):
+        widget.disconnect(self.first_paint)
+        GObject.idle_add(Gtk.main_quit)
+
+gtkgui.PhotoCollageWindow = Window
+gtkgui.main()
+"""
+
+
+def measure_imports(modules):
+    """Returns the time to import modules, and the lazy ones they loaded"""
+    code = ("import json, sys, time\n"
+            "t = time.perf_counter()\n"
+            "%s\n"
+            "t = time.perf_counter() - t\n"
+            "loaded = [m for m in %r if m in sys.modules]\n"
+            "print(json.dumps([t, loaded]))\n"
+            % ("\n".join("import %s" % m for m in modules), LAZY_MODULES))
+    out = subprocess.check_output(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out)
+
+
+class TestStartup(unittest.TestCase):
+    def test_import(self):
+        modules = list(STARTUP_MODULES)
+        if has_gtk():
+            modules.append("photocollage.gtkgui")
+
+        runs = [measure_imports(modules) for i in range(NO_RUNS)]
+        self.assertEqual(runs[0][1], [],
+                         "modules imported at startup: %s" % runs[0][1])
+        best = min(t for t, loaded in runs)
+        self.assertLessEqual(
+            best, IMPORT_BUDGET,
+            "importing the application takes %.3f s, budget is %.3f s"
+            % (best, IMPORT_BUDGET))
+
+    @unittest.skipUnless(has_gtk(), "requires GTK and a display")
+    def test_first_paint(self):
+        t = time.perf_counter()
+        subprocess.check_call(
+            [sys.executable, "-c", FIRST_PAINT_CODE], timeout=60,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        t = time.perf_counter() - t
+        self.assertLessEqual(
+            t, FIRST_PAINT_BUDGET,
+            "the window is painted after %.3f s, budget is %.3f s"
+            % (t, FIRST_PAINT_BUDGET))
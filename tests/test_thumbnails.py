@@ -0,0 +1,133 @@
+# Copyright (C) 2014 Adrien Vergé
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from photocollage import thumbnails
+
+try:
+    import PIL.Image
+    import PIL.PngImagePlugin
+
+    from photocollage import collage, render
+except ImportError:  # Pillow is not installed
+    render = None
+
+
+class TestThumbnails(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp, "cache", "thumbnails")
+        self.env = mock.patch.dict(
+            os.environ, {"XDG_CACHE_HOME": os.path.join(self.tmp, "cache")})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_names(self):
+        self.assertEqual(thumbnails.get_cache_dir(), self.cache_dir)
+        self.assertEqual(thumbnails.get_uri("/home/jens/photos/me.png"),
+                         "file:///home/jens/photos/me.png")
+        self.assertEqual(thumbnails.get_uri("/tmp/a b&c/été.jpg"),
+                         "file:///tmp/a%20b&c/%C3%A9t%C3%A9.jpg")
+        # Example from the specification
+        self.assertEqual(
+            thumbnails.get_path("/home/jens/photos/me.png", "normal"),
+            os.path.join(self.cache_dir, "normal",
+                         "c6ee772d9e49320e97ec29a7eb5b1697.png"))
+        self.assertEqual(thumbnails.get_flavor(100), "normal")
+        self.assertEqual(thumbnails.get_flavor(256), "large")
+        self.assertEqual(thumbnails.get_flavor(600), "xx-large")
+        self.assertIsNone(thumbnails.get_flavor(2000))
+
+    @unittest.skipIf(render is None, "requires Pillow")
+    def test_save_and_find(self):
+        filename = os.path.join(self.tmp, "photo.png")
+        img = PIL.Image.new("RGB", (600, 300), (255, 0, 0))
+        img.save(filename)
+        self.assertIsNone(thumbnails.find(filename, 100))
+
+        thumbnails.save(filename, img, "large")
+        path = thumbnails.get_path(filename, "large")
+        self.assertEqual(thumbnails.find(filename, 100), (path, (256, 128)))
+        self.assertEqual(thumbnails.find(filename, 256), (path, (256, 128)))
+        self.assertIsNone(thumbnails.find(filename, 257))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertEqual(thumbnails.load(filename, 200).size, (256, 128))
+
+        # Outdated thumbnail
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(thumbnails.find(filename, 100))
+
+        # Thumbnail of another file
+        shutil.copy(path, thumbnails.get_path(filename + "2", "large"))
+        shutil.copy(filename, filename + "2")
+        self.assertIsNone(thumbnails.find(filename + "2", 100))
+
+        self.assertRaises(ValueError, thumbnails.save, filename, img,
+                          "x-large")
+
+    @unittest.skipIf(render is None, "requires Pillow")
+    def test_render(self):
+        files = []
+        for i in range(3):
+            filename = os.path.join(self.tmp, "img%d.png" % i)
+            PIL.Image.new("RGB", (800, 600), (0, 0, 255)).save(filename)
+            files.append(filename)
+        page = collage.fill_page(render.build_photolist(files), 0.75, 2,
+                                 seed=1)
+        page.adjust()
+        page.scale_to_fit(160, 120)
+
+        def render_center(write_thumbnails=False):
+            render.cache.clear()
+            task = render.RenderingTask(page, border_width=2,
+                                        use_thumbnails=True,
+                                        write_thumbnails=write_thumbnails)
+            img = []
+            task.on_complete = img.append
+            task.run()
+            x, y, w, h = task.plan.cells[0].dest
+            return task.plan.cells[0].filename, \
+                img[0].getpixel((x + w // 2, y + h // 2))
+
+        # Thumbnails are only written if asked...
+        filename, color = render_center()
+        self.assertEqual(color, (0, 0, 255))
+        self.assertFalse(os.path.exists(self.cache_dir))
+        filename, color = render_center(write_thumbnails=True)
+        self.assertEqual(color, (0, 0, 255))
+        self.assertEqual(os.listdir(self.cache_dir), ["large"])
+        found = thumbnails.find(filename, 256)
+        self.assertIsNotNone(found)
+
+        # ... and read afterwards
+        with PIL.Image.open(found[0]) as thumb:
+            info = thumb.info
+            thumb = PIL.Image.new("RGB", thumb.size, (0, 255, 0))
+        pnginfo = PIL.PngImagePlugin.PngInfo()
+        for key in ("Thumb::URI", "Thumb::MTime"):
+            pnginfo.add_text(key, info[key])
+        thumb.save(found[0], pnginfo=pnginfo)
+        self.assertEqual(render_center(), (filename, (0, 255, 0)))
+        render.cache.clear()